@@ -0,0 +1,136 @@
+# Headless batch parser: python foam_batch.py <dir | glob | file>... -o out/
+import argparse
+import glob
+import os
+import sys
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+import myUtility
+
+
+# `pattern` may list several comma-separated patterns for directories
+def collect_files(inputs, pattern="*.csv,*.xlsx"):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for part in pattern.split(","):
+                files.extend(sorted(glob.glob(os.path.join(item, "**", part.strip()), recursive=True)))
+        elif glob.has_magic(item):
+            files.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            files.append(item)
+    # Keep the first occurrence of files matched by several inputs
+    return list(dict.fromkeys(os.path.normpath(path) for path in files))
+
+
+# Runs in a worker process; failures are returned instead of raised so one bad
+# sheet does not stop the batch. Workbooks get a "Sheet" column and their
+# sheets are parsed one after another within the worker. Header texts that
+# matched no measurement label are returned as well.
+def parse_file(path, extract=None):
+    unmapped_headers = Counter()
+    try:
+        with open(path, "rb") as handle:
+            data = handle.read()
+        if path.lower().endswith(".xlsx"):
+            final_df, wide_df = myUtility.parse_xlsx_sheets(data, workers=1, unmapped_headers=unmapped_headers)
+        else:
+            final_df = myUtility.build_final_df(myUtility.read_raw_sheet(data), extract, unmapped_headers=unmapped_headers)
+            wide_df = myUtility.build_wide_table(final_df)
+        final_df.insert(0, "Source File", path)
+        wide_df.insert(0, "Source File", path)
+        return path, final_df, wide_df, None, unmapped_headers
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}\n{traceback.format_exc()}", unmapped_headers
+
+
+# With split_rows set, files are parsed one at a time and each sheet is split
+# at formulation boundaries into blocks of about split_rows rows that are
+# parsed across the workers instead. Parsed files are also added to `store`
+# (a myUtility.SampleStore) when one is given.
+def run_batch(files, workers=None, chunksize=4, split_rows=None, log=sys.stderr, store=None):
+    long_frames, wide_frames, failures = [], [], []
+    if split_rows:
+        extract = partial(myUtility.extract_samples_parallel, workers=workers, block_rows=split_rows)
+        results = map(partial(parse_file, extract=extract), files)
+        executor = None
+    elif workers == 1:
+        results = map(parse_file, files)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(parse_file, files, chunksize=chunksize)
+    try:
+        for done, (path, final_df, wide_df, error, unmapped_headers) in enumerate(results, 1):
+            if error:
+                failures.append((path, error))
+                print(f"[{done}/{len(files)}] FAILED {path}: {error.splitlines()[0]}", file=log)
+            else:
+                long_frames.append(final_df)
+                wide_frames.append(wide_df)
+                print(f"[{done}/{len(files)}] {path}: {final_df['SampleID'].nunique()} samples", file=log)
+                if unmapped_headers:
+                    print(f"[{done}/{len(files)}] {path}: unrecognised header columns: {', '.join(unmapped_headers)}", file=log)
+                if store is not None:
+                    with open(path, "rb") as handle:
+                        digest = myUtility.SampleStore.digest(handle.read())
+                    if not store.add(final_df.drop(columns="Source File"), path, digest):
+                        print(f"[{done}/{len(files)}] {path} is already in the sample store", file=log)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    long_df = pd.concat(long_frames, ignore_index=True) if long_frames else pd.DataFrame()
+    wide_df = myUtility.order_wide_columns(pd.concat(wide_frames, ignore_index=True)) if wide_frames else pd.DataFrame()
+    return long_df, wide_df, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse a batch of foam stability CSV exports and Excel workbooks.")
+    parser.add_argument("inputs", nargs="+", help="CSV/XLSX files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default=".", help="where the combined tables are written")
+    parser.add_argument("--pattern", default="*.csv,*.xlsx", help="comma-separated file patterns used inside directories")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores, 1 = no pool)")
+    parser.add_argument("--format", default="csv", help="comma-separated output formats: csv, parquet, feather")
+    parser.add_argument("--split-rows", type=int, default=None, help="parse files one at a time, splitting each sheet into blocks of about this many rows across the workers")
+    parser.add_argument("--decay", action="store_true", help="also write Foam_Decay, the decay metrics of every sample")
+    parser.add_argument("--store", default=None, help="also add the parsed rows to this SQLite sample store")
+    args = parser.parse_args(argv)
+    formats = [fmt.strip().lower() for fmt in args.format.split(",") if fmt.strip()]
+    known = {extension for extension, _ in myUtility.EXPORT_FORMATS.values()}
+    if not formats or set(formats) - known:
+        parser.error(f"--format must be a comma-separated list of {', '.join(sorted(known))}")
+
+    files = collect_files(args.inputs, args.pattern)
+    if not files:
+        parser.error("no input files found")
+
+    long_df, wide_df, failures = run_batch(files, workers=args.workers, split_rows=args.split_rows,
+                                          store=myUtility.SampleStore(args.store) if args.store else None)
+
+    decay_df = myUtility.foam_decay_metrics(long_df) if args.decay and not long_df.empty else None
+    os.makedirs(args.output_dir, exist_ok=True)
+    written = []
+    for fmt in formats:
+        tables = [("Parsed_Foam_Data", long_df), ("Parsed_Foam_Data_Wide", wide_df)]
+        if args.decay and not long_df.empty:
+            tables.append(("Foam_Decay", decay_df))
+        for name, table in tables:
+            path = os.path.join(args.output_dir, f"{name}.{fmt}")
+            with open(path, "wb") as handle:
+                handle.write(myUtility.export_table(table, fmt))
+            written.append(path)
+
+    print(f"{len(files) - len(failures)}/{len(files)} files parsed, {len(long_df)} rows -> {', '.join(written)}", file=sys.stderr)
+    for path, error in failures:
+        print(f"--- {path}\n{error}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Per-stage benchmark of the parsing pipeline on synthetic sheets:
+#   python foam_bench.py --sizes 1000,10000,100000 --save-baseline
+#   python foam_bench.py --sizes 1000,10000,100000          (compare to baseline)
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import sys
+
+import pandas as pd
+
+import foam_synth
+import myUtility
+
+
+def sheet_bytes(n_rows, seed=0):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(foam_synth.generate_rows(n_rows, seed))
+    return buffer.getvalue().encode("utf-8")
+
+
+# Best-of-`repeat` wall time per stage, then one pass with tracemalloc for the
+# peak memory of each stage (kept separate so tracing does not skew timings),
+# also as a multiple of the size of the final long table
+def bench_size(n_rows, repeat=3, seed=0):
+    data = sheet_bytes(n_rows, seed)
+    stages = {}
+    for _ in range(repeat):
+        profile = myUtility.PipelineProfile()
+        myUtility.parse_foam_csv(data, profile=profile)
+        for record in profile.stages:
+            entry = stages.setdefault(record["stage"], {"seconds": record["seconds"], "rows": record["rows"]})
+            entry["seconds"] = min(entry["seconds"], record["seconds"])
+
+    profile = myUtility.PipelineProfile(track_memory=True)
+    result = myUtility.parse_foam_csv(data, profile=profile)
+    table_mb = result["final_df"].memory_usage(deep=True).sum() / 1e6
+    for record in profile.stages:
+        stages[record["stage"]]["peak_mb"] = record["peak_mb"]
+    stages["total"] = {
+        "seconds": sum(entry["seconds"] for entry in stages.values()),
+        "rows": n_rows,
+        "peak_mb": max(entry.get("peak_mb") or 0 for entry in stages.values()),
+    }
+    for entry in stages.values():
+        entry["peak_x_table"] = entry["peak_mb"] / table_mb if table_mb else None
+    return stages
+
+
+# Stages whose peak memory is above `max_ratio` x the final table
+def find_memory_overruns(results, max_ratio=2.0):
+    return [
+        (size, stage, entry["peak_x_table"])
+        for size, stages in results["sizes"].items()
+        for stage, entry in stages.items()
+        if stage != "total" and entry.get("peak_x_table") and entry["peak_x_table"] > max_ratio
+    ]
+
+
+# Stages slower than `tolerance` x baseline (and by more than `min_seconds`)
+def find_regressions(results, baseline, tolerance=1.3, min_seconds=0.02):
+    regressions = []
+    for size, stages in results["sizes"].items():
+        for stage, entry in stages.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(stage)
+            if not previous:
+                continue
+            if entry["seconds"] > previous["seconds"] * tolerance and entry["seconds"] - previous["seconds"] > min_seconds:
+                regressions.append((size, stage, previous["seconds"], entry["seconds"]))
+    return regressions
+
+
+def print_table(results, baseline=None, out=sys.stdout):
+    rows = []
+    for size, stages in results["sizes"].items():
+        for stage, entry in stages.items():
+            previous = (baseline or {}).get("sizes", {}).get(size, {}).get(stage)
+            rows.append({
+                "rows": int(size),
+                "stage": stage,
+                "seconds": round(entry["seconds"], 4),
+                "peak_mb": round(entry["peak_mb"], 2) if entry.get("peak_mb") is not None else None,
+                "x_table": round(entry["peak_x_table"], 2) if entry.get("peak_x_table") is not None else None,
+                "vs_baseline": round(entry["seconds"] / previous["seconds"], 2) if previous and previous["seconds"] else None,
+            })
+    print(pd.DataFrame(rows).to_string(index=False), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the foam parsing pipeline per stage.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated sheet sizes in rows (up to 1000000)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="slowdown factor reported as a regression")
+    parser.add_argument("--output", help="also write the results as JSON here")
+    parser.add_argument("--max-peak-ratio", type=float, default=2.0, help="warn when a stage's peak memory exceeds this multiple of the final table")
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "sizes": {},
+    }
+    for size in [int(value) for value in args.sizes.split(",") if value.strip()]:
+        print(f"benchmarking {size} rows...", file=sys.stderr)
+        results["sizes"][str(size)] = bench_size(size, args.repeat, args.seed)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+    print_table(results, baseline)
+    for size, stage, ratio in find_memory_overruns(results, args.max_peak_ratio):
+        print(f"MEMORY {stage} @ {size} rows: peak {ratio:.2f}x the final table", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for size, stage, before, after in regressions:
+            print(f"REGRESSION {stage} @ {size} rows: {before:.4f}s -> {after:.4f}s", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,121 +1,283 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import myUtility
-import re
-from io import BytesIO
+import logging
+import os
+from functools import partial
 
 st.set_page_config(page_title="Foam (no Oil) Sample Extractor")
 st.title("Foam (no Oil) Sample Extractor")
 
+# Set FOAM_PARSER_CACHE_DIR to keep parsed uploads and blocks across app restarts
+CACHE_DIR = os.environ.get("FOAM_PARSER_CACHE_DIR")
+
+
+@st.cache_resource
+def get_parse_cache():
+    return myUtility.ParseCache(max_entries=8, directory=CACHE_DIR)
+
+
+# Set FOAM_SAMPLE_STORE to choose where parsed uploads are collected for querying
+@st.cache_resource
+def get_sample_store():
+    return myUtility.SampleStore(os.environ.get("FOAM_SAMPLE_STORE", "foam_samples.sqlite"))
+
+
+# Set FOAM_BLOCK_STORE to choose where parsed formulation blocks are kept
+# for re-uploads (default blocks.sqlite in FOAM_PARSER_CACHE_DIR when set,
+# otherwise foam_blocks.sqlite)
+@st.cache_resource
+def get_block_store():
+    default = os.path.join(CACHE_DIR, "blocks.sqlite") if CACHE_DIR else "foam_blocks.sqlite"
+    return myUtility.BlockStore(os.environ.get("FOAM_BLOCK_STORE", default))
+
+
+# Parse stages are logged as JSON lines to stderr while profiling
+@st.cache_resource
+def get_profile_logger():
+    logger = logging.getLogger("foam_parser")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+# Stage timings and row-class counts of the last parse; nothing is measured
+# unless profiling is switched on
+def show_parse_statistics(profile):
+    st.sidebar.markdown("### ⏱️ Parse statistics")
+    stages = pd.DataFrame(profile)[["stage", "seconds", "peak_mb", "rows"]]
+    st.sidebar.caption(f"Total {stages['seconds'].sum():.2f} s")
+    st.sidebar.dataframe(stages, hide_index=True)
+    row_classes = next((stage["row_classes"] for stage in profile if "row_classes" in stage), None)
+    if row_classes:
+        st.sidebar.dataframe(pd.Series(row_classes, name="rows").rename_axis("row class").reset_index(), hide_index=True)
+
+
+# One page of `table` at a time: sorting, filtering and column selection
+# run here against the cached table and only the visible rows are sent to
+# the browser
+def show_table(table, key, page_size=100):
+    # Choices made for another set of columns (an earlier upload or query)
+    # are dropped, so new columns are not hidden by a stale selection
+    if st.session_state.get(f"{key}_table_columns") != list(table.columns):
+        st.session_state[f"{key}_table_columns"] = list(table.columns)
+        for widget in ("columns", "sort", "filter_column"):
+            st.session_state.pop(f"{key}_{widget}", None)
+    with st.expander("Columns, sorting and filter"):
+        columns = st.multiselect("Columns:", list(table.columns), default=list(table.columns), key=f"{key}_columns")
+        sort_by = st.selectbox("Sort by:", ["(original order)"] + list(table.columns), key=f"{key}_sort")
+        descending = st.checkbox("Descending", key=f"{key}_descending")
+        filter_column = st.selectbox("Filter column:", list(table.columns), key=f"{key}_filter_column")
+        filter_text = st.text_input("Filter text (contains):", key=f"{key}_filter_text")
+    positions = myUtility.table_positions(
+        table,
+        sort_by=None if sort_by == "(original order)" else sort_by,
+        ascending=not descending,
+        filter_column=filter_column,
+        filter_text=filter_text,
+    )
+    if not len(positions):
+        st.info(f"No rows match the filter (of {len(table)})." if len(table) else "No rows.")
+        return
+    pages = max(1, -(-len(positions) // page_size))
+    # The page lives in session state only (no widget default) so it can be
+    # pulled back when a filter leaves fewer pages
+    st.session_state[f"{key}_page"] = min(st.session_state.get(f"{key}_page", 1), pages)
+    page = st.number_input(f"Page (of {pages}):", min_value=1, max_value=pages, key=f"{key}_page")
+    start = (page - 1) * page_size
+    st.dataframe(table.iloc[positions[start:start + page_size]][columns or list(table.columns)])
+    st.caption(f"Rows {min(start + 1, len(positions))}–{min(start + page_size, len(positions))} of {len(positions)}" + (f" (filtered from {len(table)})" if len(positions) != len(table) else ""))
+
+
+# Counts per SampleID/Dilution, kept on the cached result like the downloads
+def summary_table(result):
+    if "summary" not in result:
+        result["summary"] = myUtility.sample_summary(result["final_df"])
+    return result["summary"]
+
+
+# Decay metrics of the latest threshold and their exported bytes, kept on
+# the cached result as well; another threshold replaces them
+def decay_table(result, threshold):
+    decay = result.get("decay")
+    if decay is None or decay["threshold"] != threshold:
+        decay = result["decay"] = {"threshold": threshold, "table": myUtility.foam_decay_metrics(result["final_df"], threshold)}
+    return decay["table"]
+
+
+def decay_bytes(result, extension):
+    decay = result["decay"]
+    if extension not in decay:
+        decay[extension] = myUtility.export_table(decay["table"], extension)
+    return decay[extension]
+
+
+# Exported bytes are kept on the cached result so reruns don't re-serialize
+def download_bytes(result, table, extension):
+    if extension == "csv":
+        return result["csv" if table == "final_df" else "wide_csv"]
+    key = f"{table}_{extension}"
+    if key not in result:
+        result[key] = myUtility.export_table(result[table], extension)
+    return result[key]
+
+
+# Filters over every upload collected in the sample store
+def show_sample_store():
+    store = get_sample_store()
+    columns = store.columns()
+    if not columns:
+        st.info("The sample store is empty; parsed uploads are added to it automatically.")
+        return
+    st.dataframe(store.sources(), hide_index=True)
+    filters = []
+    for i in range(st.number_input("Number of filters:", min_value=0, max_value=10, value=1)):
+        left, middle, right = st.columns([3, 2, 3])
+        column = left.selectbox("Column", list(columns), key=f"store_column_{i}")
+        operator = middle.selectbox("Operator", myUtility.QUERY_OPERATORS, key=f"store_operator_{i}")
+        value = right.text_input("Value", key=f"store_value_{i}")
+        if value or operator in ("is empty", "is not empty"):
+            filters.append((column, operator, value))
+    try:
+        rows = store.query(filters)
+    except ValueError as e:
+        st.error(f"⚠️ Error: {str(e)}")
+        return
+    st.success(f"**🧾 {len(rows)} rows from {rows['SampleID'].nunique()} samples match.**")
+    show_table(rows, "store")
+    st.download_button("📥 Download Matching Rows", rows.to_csv(index=False).encode("utf-8"), file_name="Foam_Sample_Query.csv", mime="text/csv")
+
+
+page = st.sidebar.radio("Page:", ["Parse upload", "Query sample store"])
+if page == "Query sample store":
+    st.markdown("### 🗄️ Sample Store")
+    show_sample_store()
+    st.stop()
+
+profile_parsing = st.sidebar.checkbox("Profile parsing")
+track_memory = profile_parsing and st.sidebar.checkbox("Track peak memory (slower)")
+
 # Upload section
-uploaded_file = st.file_uploader("Upload CSV File", type=["csv"])
+uploaded_file = st.file_uploader("Upload CSV or Excel File", type=["csv", "xlsx"])
 if uploaded_file is not None:
-    try:
-        df = pd.read_csv(uploaded_file)  # default utf-8
-    except UnicodeDecodeError:
-        # Try with alternative encoding
-        uploaded_file.seek(0)  # reset file pointer
-        df = pd.read_csv(uploaded_file, encoding="cp1252")  # or "ISO-8859-1"
-    
+    data = uploaded_file.getvalue()
+    # The upload is hashed once; reruns reuse the digest for every cache key
+    if st.session_state.get("upload_id") != uploaded_file.file_id:
+        st.session_state["upload_id"] = uploaded_file.file_id
+        st.session_state["upload_digest"] = myUtility.SampleStore.digest(data)
+    digest = st.session_state["upload_digest"]
+    # Workbooks are parsed sheet by sheet; the preview shows the first sheet
+    is_workbook = uploaded_file.name.lower().endswith(".xlsx")
+    read_preview = myUtility.read_xlsx_preview if is_workbook else myUtility.read_preview
+    df = get_parse_cache().get_or_parse(data, read_preview, kind="preview", digest=digest)
+
     st.write("Preview of the uploaded file:")
-    st.dataframe(df)
+    show_table(df, "preview")
 
 if uploaded_file is not None:
     try:
-        
-        df_input = pd.read_csv(uploaded_file, header=None)
-        samples, formulations = myUtility.extract_samples_complete_fixed(df_input)
-        df_samples = pd.DataFrame(samples)
-        df_formulations = pd.DataFrame.from_dict(formulations, orient="index")
-        df_formulations["SampleID"] = df_formulations.index
-        final_df = df_samples.merge(df_formulations, on="SampleID", how="left")
-
-        # Create the new columns with default NaN
-        final_df["Initial Foam Volume (cc)"] = "5cc"  # Set default value
-        final_df["Pilot"] = np.nan
-        final_df["Temp Foam Monitoring"] = np.nan
-        final_df["Initial Foam Temp"] = np.nan  # No logic yet, reserved
-        final_df["Water (cc)"] = np.nan   
-        final_df["Sonicated"] = np.nan  
-
-        # Apply the processing
-        final_df[["Pilot", "Temp Foam Monitoring", "Initial Foam Volume (cc)", "Dilution", "Ratio","Sonicated"]] = final_df.apply(
-            lambda row: pd.Series(myUtility.process_dilution(row["Dilution"])),
-            axis=1
-        )
-        final_df["Tube Volume (mL)"] = final_df["Tube Volume (mL)"].astype(str).str.replace(r"mL\s*tube", "", case=False, regex=True).str.strip()
-        final_df = myUtility.assign_pilot_column(final_df)
-        final_df = final_df.drop_duplicates()
-
-        final_df["time"] = None
-        final_df = final_df.replace({None: np.nan})
-        #final_df.to_csv("Parsed_Foam_Data.csv", index=False)
-        df_input = final_df
-        df_input = df_input[df_input["Day"].notna()]
-        # Convert Day column to numeric index
-        df_input["Day_Num"] = df_input["Day"].str.extract(r'(\d+)').astype(int)
-        # Get max day number
-        max_day = df_input["Day_Num"].max()
-        # Identify formulation columns
-        formulation_cols = [
-            col for col in df_input.columns
-            if col not in ["SampleID", "Day", "Day_Num", "Foam (cc)", "Foam Texture", "Date", "Baseline", "Pilot"]
-        ]
-
-        # Recreate the output with SampleID and full Dilution preserved
-        output_rows = []
-        for (sample_id, dilution), group in df_input.groupby(["SampleID", "Dilution"]):
-            row = {"SampleID": sample_id, "Dilution": dilution}
-
-            for col in formulation_cols:
-                if col in group.columns:
-                    row[col] = group[col].dropna().iloc[0] if not group[col].dropna().empty else np.nan
-
-            day0_row = group[group["Day_Num"] == 0]
-            row["Date"] = day0_row["Date"].iloc[0] if not day0_row.empty else np.nan
-            row["Baseline"] = "*" if group["Baseline"].astype(str).str.contains(r"\*").any() else ""
-            pilot_val = group["Pilot"].dropna()
-            row["Pilot"] = pilot_val.iloc[0] if not pilot_val.empty else ""
-
-            for day in range(max_day + 1):
-                day_row = group[group["Day_Num"] == day]
-                row[f"Day {day} - Amount (cc)"] = day_row["Foam (cc)"].values[0] if not day_row.empty else np.nan
-                row[f"Day {day} - Foam Texture"] = day_row["Foam Texture"].values[0] if not day_row.empty else ""
-
-            output_rows.append(row)
-
-
-        # Create DataFrame
-        df_transformed_fixed = pd.DataFrame(output_rows)
+        if is_workbook:
+            parse = myUtility.parse_foam_xlsx
+        else:
+            parse = partial(myUtility.parse_foam_csv, block_store=get_block_store())
+        result = get_parse_cache().get_or_parse(data, parse, digest=digest)
+        if profile_parsing:
+            # Re-parse once with a profile when the cached result has none,
+            # without the block store so "extract" times the extractor
+            # rather than cache reads
+            stages = result.get("profile") or []
+            if not stages or track_memory != any(stage["peak_mb"] is not None for stage in stages):
+                profile = myUtility.PipelineProfile(track_memory=track_memory, logger=get_profile_logger())
+                profiled_parse = myUtility.parse_foam_xlsx if is_workbook else myUtility.parse_foam_csv
+                result = get_parse_cache().get_or_parse(data, partial(profiled_parse, profile=profile), refresh=True, digest=digest)
+            show_parse_statistics(result["profile"])
+        final_df = result["final_df"]
+        df_transformed_fixed = result["wide_df"]
 
         st.success("✅ Parsing complete...")
+        if get_sample_store().add(final_df, uploaded_file.name, digest):
+            st.caption(f"{len(final_df)} rows added to the sample store.")
+        else:
+            st.caption(f"{uploaded_file.name} is already in the sample store.")
         st.success(f"**🧾 {final_df['SampleID'].nunique()} Samples are extracted.**")
+        if result["unmapped_headers"]:
+            unmapped = ", ".join(f"{header} ({count})" for header, count in result["unmapped_headers"].items())
+            st.warning(f"Header columns not recognised (not parsed): {unmapped}")
+        if result["block_stats"]:
+            st.caption(f"{result['block_stats']['reused']} of {result['block_stats']['blocks']} formulation blocks reused from earlier uploads.")
         #st.success(f"**🧾 Numbers of 'HS' in the input file:  {day_0_count}**")
         #st.success(f"**🧾 Numbers of 'Foam (cc)' in the input file: {foam_cc_count}**")
 
-        st.dataframe(final_df)
+        show_table(final_df, "parsed")
+
+        st.markdown("### 🧮 Rows per SampleID / Dilution")
+        show_table(summary_table(result), "summary")
  
         # Prepare download
-        csv = final_df.to_csv(index=False).encode("utf-8")
+        export_format = st.selectbox("Download format:", list(myUtility.EXPORT_FORMATS))
+        extension, mime = myUtility.EXPORT_FORMATS[export_format]
         st.download_button(
             label="📥 Download Parsed Data",
-            data=csv,
-            file_name="Parsed_Foam_Data.csv",
-            mime="text/csv"
+            data=download_bytes(result, "final_df", extension),
+            file_name=f"Parsed_Foam_Data.{extension}",
+            mime=mime
         )
+
+        st.markdown("### 📅 Per-day Foam Table")
+        show_table(df_transformed_fixed, "wide")
+        st.download_button(
+            label="📥 Download Per-day Foam Table",
+            data=download_bytes(result, "wide_df", extension),
+            file_name=f"Parsed_Foam_Data_Wide.{extension}",
+            mime=mime
+        )
+
+        st.markdown("### 📉 Foam Decay")
+        threshold = st.number_input("Foam threshold (cc), 0 = half the first reading:", min_value=0.0, value=0.0, step=1.0)
+        decay = decay_table(result, threshold or None)
+        show_table(decay, "decay")
+        st.download_button("📥 Download Foam Decay", decay_bytes(result, extension), file_name=f"Foam_Decay.{extension}", mime=mime)
         # SampleID search box
         if "final_df" in locals():
             st.markdown("### 🔍 Search for a SampleID")
-            search_id = st.text_input("Enter SampleID to search:")
+            search_by = st.radio("Search by:", ["SampleID", "Chemical"], horizontal=True)
+            match_mode = st.radio("Match:", ["Exact", "Prefix", "Fuzzy"], horizontal=True)
+            search_id = st.text_input(f"Enter {search_by} to search:")
 
             if search_id:
-                filtered_df = final_df[final_df["SampleID"].astype(str).str.strip().str.lower() == search_id.strip().lower()]
+                sample_index = result["index"]
+                if search_by == "SampleID":
+                    positions = sample_index.search(search_id, match_mode.lower())
+                else:
+                    positions = sample_index.search_chemical(search_id, match_mode.lower())
+                filtered_df = final_df.iloc[positions]
                 if not filtered_df.empty:
-                    st.dataframe(filtered_df)
+                    show_table(filtered_df, "search")
                 else:
-                    st.warning(f"No exact match found for SampleID: {search_id}")
+                    st.warning(f"No {match_mode.lower()} match found for {search_by}: {search_id}")
+
+            st.markdown("### 🧭 Similar Formulations")
+            similar_id = st.text_input("SampleID to compare:")
+            left, middle, right = st.columns(3)
+            n_similar = left.number_input("Neighbours:", min_value=1, max_value=500, value=20)
+            stable = {}
+            for column, flag in zip([middle, right], myUtility.CompositionMatrix.FLAG_COLUMNS):
+                wanted = column.selectbox(f"{flag}:", ["Any", "Yes", "No"], key=f"similar_{flag}")
+                if wanted != "Any":
+                    stable[flag] = wanted == "Yes"
+            if similar_id:
+                composition = result["composition"]
+                try:
+                    sample = composition.frame([similar_id.strip()])
+                    show_table(sample.loc[:, (sample != 0).any()], "similar_sample")
+                    show_table(composition.nearest(similar_id.strip(), n_similar, stable), "similar")
+                except ValueError as e:
+                    st.warning(str(e))
     except Exception as e:
         st.error(f"⚠️ Error: {str(e)}")
 else:
-    st.info("👈 Upload a CSV file to begin.")
+    st.info("👈 Upload a CSV or Excel file to begin.")
@@ -0,0 +1,106 @@
+# Synthetic foam stability sheets for benchmarks: python foam_synth.py 100000 -o sheet.csv
+import argparse
+import csv
+import random
+
+WIDTH = 12
+CHEMICALS = ["CapB", "Citric acid", "SLES", "Glycerin", "Xanthan gum", "NaCl", "Cocamide DEA", "Polyquaternium-10"]
+STABILITY_NOTES = ["", "", "Stable at 4C", "Stable at 8C", "Unstable at 4C", "Unstable at 8C", "unstable concentrate", "Stable at 4C, unstable at 8C"]
+DILUTION_LABELS = ["", "", "AFC", "sonicated", "no sonic", "(1:2) ratio", "(1:3) ratio", "10cc", "4C", "20cc 8C", "AFC sonicated"]
+TEXTURES = ["fine", "coarse", "creamy", "bubbly", "dense", "wet", "dry", "collapsed"]
+HEADERS = [
+    ["Day", "Date", "Foam amount (cc)", "Foam texture", "Zeta", "Conductivity", "Size", "PI", "Water (cc)"],
+    ["Day", "Date", "Foam (cc)", "Texture", "Zeta potential", "Conductivity (mS)", "Size (nm)"],
+    ["Day", "Date", "Foam amount", "Foam texture"],
+]
+
+
+def _row(*values):
+    row = [str(value) for value in values][:WIDTH]
+    return row + [""] * (WIDTH - len(row))
+
+
+def _formulation_row(rng, index):
+    parts = []
+    for chem in rng.sample(CHEMICALS, rng.randint(1, 4)):
+        if rng.random() < 0.5:
+            parts.append(f"{rng.choice([0.1, 0.5, 1, 2.5, 5, 10])}% {chem}")
+        else:
+            parts.append(f"{rng.choice([50, 100, 250, 500, 1000])} ppm {chem}")
+    text = ", ".join(parts)
+    roll = rng.random()
+    if roll < 0.85:
+        text += f" (F{index:06d})"
+    elif roll < 0.95:
+        text += f" (F{index:06d}) retest"
+    return _row(text, rng.choice(STABILITY_NOTES), rng.choice(STABILITY_NOTES) if rng.random() < 0.2 else "")
+
+
+def _dilution_rows(rng):
+    dilution = f"{rng.choice([2, 5, 10, 20, 50])}{rng.choice(['X', 'x', ' X'])}"
+    tube = f"{rng.choice([15, 50])} mL tube" if rng.random() < 0.8 else ""
+    label = rng.choice(DILUTION_LABELS)
+    header = rng.choice(HEADERS)
+    if rng.random() < 0.25:
+        # Foam header on the dilution row itself
+        return [_row(dilution, tube, label, *header[2:])], 1
+    return [_row(dilution, tube, label), _row(*header)], 0
+
+
+def _day_rows(rng, day, header_offset):
+    foam = rng.randint(0, 60)
+    texture = rng.choice(TEXTURES) if rng.random() < 0.9 else ""
+    values = [f"Day {day}", f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/2024"]
+    if header_offset:
+        values.append("")
+    values += [f"{foam}{' cc' if rng.random() < 0.1 else ''}", texture, f"{rng.uniform(-60, 0):.1f}", f"{rng.uniform(0, 5):.2f}", rng.randint(50, 900), f"{rng.uniform(0, 1):.2f}"]
+    if rng.random() < 0.1:
+        values += ["", "*"]
+    rows = [_row(*values)]
+    if rng.random() < 0.15:
+        # Texture continued on the next row
+        continuation = [""] * WIDTH
+        continuation[3 + header_offset] = rng.choice(TEXTURES)
+        rows.append(continuation)
+    return rows
+
+
+# Rows of a messy lab sheet with roughly `n_rows` rows: formulation rows with
+# %/ppm chemicals, (ID) tags and stability notes, dilution rows with tube
+# volume and AFC/sonicated/ratio/cc labels, foam header rows, Day rows with
+# texture continuation rows and "*" baseline markers, plus notes and blanks.
+def generate_rows(n_rows, seed=0):
+    rng = random.Random(seed)
+    rows = [_row("Foam stability study", "", "exported 2024")]
+    index = 0
+    while len(rows) < n_rows:
+        index += 1
+        rows.append(_formulation_row(rng, index))
+        if rng.random() < 0.05:
+            rows.append(_row("note: concentrate separated"))
+            continue
+        for _ in range(rng.randint(1, 3)):
+            dilution_rows, header_offset = _dilution_rows(rng)
+            rows.extend(dilution_rows)
+            for day in range(rng.choice([1, 3, 7, 14, 28])):
+                rows.extend(_day_rows(rng, day, header_offset))
+        rows.append([""] * WIDTH)
+    return rows[:n_rows]
+
+
+def write_csv(path, n_rows, seed=0):
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        csv.writer(handle).writerows(generate_rows(n_rows, seed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic foam stability sheet.")
+    parser.add_argument("rows", type=int, help="approximate number of rows")
+    parser.add_argument("-o", "--output", default="synthetic_foam.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_csv(args.output, args.rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
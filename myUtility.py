@@ -1,209 +1,779 @@
 # utility.py
+import contextlib
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import pickle
 import re
+import sqlite3
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import combinations, islice
 import numpy as np
+import openpyxl
 import pandas as pd
- 
-def extract_samples_complete_fixed(df):
-    samples = []
+
+FORMULATION_PATTERN = re.compile(r"%|ppm", re.IGNORECASE)
+DAY_PATTERN = re.compile(r"Day\s*\d+", re.IGNORECASE)
+DILUTION_PATTERN = re.compile(r"\d+\s*X", re.IGNORECASE)
+ROW_CLASSES = ["formulation", "day", "dilution", "header", "continuation", "noise"]
+# How the extractor actually consumed each row (header and continuation rows
+# only count when they follow a dilution or Day row)
+WALKED_ROW_CLASSES = ["formulation", "dilution", "header", "day", "continuation", "skipped"]
+
+
+# Rows classified per call by classify_rows; bounds the temporary string
+# copies of the sheet
+CLASSIFY_CHUNK_ROWS = 16384
+
+
+# Tag every row in column-wise passes over chunks of CLASSIFY_CHUNK_ROWS rows:
+# the lower-cased comma-joined row text, one boolean column per row class,
+# the non-empty cell count, the first non-empty column position and the
+# resulting "row_class" (first match in ROW_CLASSES order).
+def classify_rows(df):
+    n_rows = df.shape[0]
+    if n_rows > CLASSIFY_CHUNK_ROWS:
+        chunks = [classify_rows(df.iloc[start:start + CLASSIFY_CHUNK_ROWS]) for start in range(0, n_rows, CLASSIFY_CHUNK_ROWS)]
+        return pd.concat(chunks, ignore_index=True)
+    if n_rows == 0 or df.shape[1] == 0:
+        tags = pd.DataFrame(False, index=range(n_rows), columns=ROW_CLASSES[:-1])
+        tags.insert(0, "row_text", "")
+        tags["non_empty"] = 0
+        tags["first_column"] = None
+        tags["row_class"] = "noise"
+        return tags
+
+    first_cell = df.iloc[:, 0].astype(str).str.strip()
+    filled = df.fillna("").astype(str)
+    row_text = filled.iloc[:, 0].str.cat([filled.iloc[:, i] for i in range(1, df.shape[1])], sep=",").str.lower()
+    present = df.notna().to_numpy()
+
+    tags = pd.DataFrame({
+        "row_text": row_text.to_numpy(),
+        "formulation": (first_cell.str.contains(FORMULATION_PATTERN, na=False)
+                        & first_cell.str.contains("(", regex=False, na=False)).to_numpy(),
+        "day": first_cell.str.match(DAY_PATTERN, na=False).to_numpy(),
+        "dilution": row_text.str.contains(DILUTION_PATTERN, na=False).to_numpy(),
+        "header": row_text.str.contains("foam", regex=False, na=False).to_numpy(),
+    })
+    tags["non_empty"] = present.sum(axis=1)
+    tags["continuation"] = tags["non_empty"] == 1
+    tags["first_column"] = present.argmax(axis=1)
+    tags["row_class"] = np.select([tags[name] for name in ROW_CLASSES[:-1]], ROW_CLASSES[:-1], default="noise")
+    return tags
+
+
+def formulation_sample_id(text):
+    return re.search(r"\((.*?)\)", text).group(1).strip() if re.search(r"\((.*?)\)", text) else None
+
+
+def parse_formulation(text):
+    data = {
+        "SampleID": formulation_sample_id(text)
+    }
+    seen_keys_lower = set()
+    for p in re.split(r'[,-]', text):
+        p = p.strip()
+        ppm_match = re.match(r"(\d+\.?\d*)\s*ppm\s*(.*)", p, re.IGNORECASE)
+        if ppm_match:
+            val, chem = ppm_match.groups()
+            chem = re.sub(r"\(.*?\)", "", chem).strip()
+            chem_key = f"{chem} (ppm)"
+            if chem_key.lower() not in seen_keys_lower:
+                data[chem_key] = float(val)
+                seen_keys_lower.add(chem_key.lower())
+            continue
+        percent_match = re.match(r"(\d+\.?\d*)%\s*(.*)", p, re.IGNORECASE)
+        if percent_match:
+            val, chem = percent_match.groups()
+            chem = re.sub(r"\(.*?\)", "", chem).strip()
+            chem_key = f"{chem} (%)"
+            if chem_key.lower() not in seen_keys_lower:
+                data[chem_key] = float(val)
+                seen_keys_lower.add(chem_key.lower())
+    return data
+
+
+def is_missing(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+
+# Stable at 8C / 4C flags from a formulation row
+def parse_stability(cells):
+    s8, s4 = np.nan, np.nan
+    if "unstable concentrate" in str(cells[0]).strip().lower():
+        s8 = False
+        s4 = False
+
+    values_to_check = [
+        str(cells[col]).lower().strip()
+        for col in range(1, min(11, len(cells)))
+        if not is_missing(cells[col])
+    ]
+    for val in values_to_check:
+        if "unstable concentrate" in val:
+            s4 = False
+            s8 = False
+        if "unstable at 4c" in val:
+            s4 = False
+        elif "stable at 4c" in val and s4 is not False:
+            s4 = True
+        if "unstable at 8c" in val:
+            s8 = False
+        elif "stable at 8c" in val and s8 is not False:
+            s8 = True
+    return s8, s4
+
+
+def single_row_sample(sample_id, s8, s4):
+    return {
+        "SampleID": sample_id,
+        "Dilution": None,
+        "Day": None,
+        "Foam (cc)": None,
+        "Foam Texture": None,
+        "Water (cc) (cc)": None,
+        "Zeta": None,
+        "Conductivity": None,
+        "Size": None,
+        "PI": None,
+        "Baseline": None,
+        "Date": None,
+        "Stable at 8C": s8,
+        "Stable at 4C": s4,
+        "Tube Volume (mL)": None
+    }
+
+
+# Dilution label ("10X AFC sonicated") and tube volume from a dilution row
+def parse_dilution_row(cells, dilution_search):
+    base_dilution = dilution_search.group(0).replace(" ", "").upper()
+    extra_label = []
+    tube_volume = ""
+
+    for col in range(1, 6):
+        if col < len(cells):
+            val = str(cells[col]).strip()
+            if val and val.lower() != "nan":
+                if "ml" in val.lower():
+                    tube_volume = val
+                else:
+                    extra_label.append(val)
+
+    return base_dilution + (" " + " ".join(extra_label) if extra_label else ""), tube_volume
+
+
+# Header synonyms per measurement label: regular expressions searched in
+# the lower-cased header cell, labels tried in this order. Labs can add
+# their own spellings (or new numeric measurements) with a JSON file of the
+# same shape named by FOAM_HEADER_SYNONYMS.
+HEADER_SYNONYMS = {
+    "Foam (cc)": [r"foam amount", r"^(?=.*foam).*cc"],
+    "Foam Texture": [r"texture"],
+    "Zeta": [r"zeta"],
+    "PI": [r"\bpi\b", r"\bpdi\b", r"polydispersity"],
+    "Conductivity": [r"conductivity"],
+    "Size": [r"size"],
+    "Water (cc)": [r"^(?=.*\bwater\b).*cc"],
+    "Date": [r"date"],
+}
+# Header cells that are known but not measurements
+HEADER_IGNORED = [r"^day\b"]
+HEADER_LABELS = ["Date", "Foam (cc)", "Foam Texture", "Water (cc)", "Zeta", "Conductivity", "Size", "PI"]
+TEXT_LABELS = ["Date", "Foam Texture"]
+
+
+# HEADER_SYNONYMS with the patterns of a JSON file added (new labels last)
+def load_header_synonyms(path):
+    with open(path) as handle:
+        extra = json.load(handle)
+    synonyms = {label: list(patterns) for label, patterns in HEADER_SYNONYMS.items()}
+    for label, patterns in extra.items():
+        synonyms.setdefault(label, []).extend([patterns] if isinstance(patterns, str) else patterns)
+    return synonyms
+
+
+# Header row -> ({label: column position}, header texts matching no label);
+# the last column wins when several match a label. Results are memoized on
+# the row's cell texts since a sheet repeats the same few header rows.
+class HeaderMapper:
+    def __init__(self, synonyms=None, ignored=None, max_cached=4096):
+        self.synonyms = HEADER_SYNONYMS if synonyms is None else synonyms
+        self.ignored = HEADER_IGNORED if ignored is None else ignored
+        self._patterns = [(label, re.compile("|".join(f"(?:{pattern})" for pattern in patterns))) for label, patterns in self.synonyms.items()]
+        self._ignored = re.compile("|".join(self.ignored) or r"(?!)")
+        self.fingerprint = hashlib.sha1(json.dumps([self.synonyms, self.ignored]).encode()).hexdigest()[:12]
+        self.max_cached = max_cached
+        self._cache = {}
+
+    def _label(self, text):
+        for label, pattern in self._patterns:
+            if pattern.search(text):
+                return label
+        return None
+
+    def map(self, header_cells):
+        key = tuple("" if is_missing(val) else str(val) for val in header_cells)
+        mapping = self._cache.get(key)
+        if mapping is None:
+            column_map = {}
+            unmapped = []
+            for i, val in enumerate(key):
+                text = val.strip().lower()
+                label = self._label(text)
+                if label:
+                    column_map[label] = i
+                elif text and text != "nan" and not self._ignored.search(text):
+                    unmapped.append(val.strip())
+            if len(self._cache) >= self.max_cached:
+                self._cache.clear()
+            mapping = self._cache[key] = (column_map, tuple(unmapped))
+        return mapping
+
+
+HEADER_MAPPER = HeaderMapper(load_header_synonyms(os.environ["FOAM_HEADER_SYNONYMS"]) if os.environ.get("FOAM_HEADER_SYNONYMS") else None)
+
+
+# Measurement label -> column position for a foam header row
+def map_header_columns(header_cells, mapper=None):
+    return (mapper or HEADER_MAPPER).map(header_cells)[0]
+
+
+# Measurements of one Day row; stability and tube volume are added by the caller
+def parse_day_row(cells, column_map, formulation, dilution):
+    row_data = {"SampleID": formulation["SampleID"]} if formulation else {}
+    row_data["Dilution"] = dilution
+    row_data["Day"] = str(cells[0]).strip()
+    stars = ["*" for i in range(column_map.get("Foam Texture", 0) + 1, len(cells)) if "*" in str(cells[i])]
+    row_data["Baseline"] = ", ".join(stars) if stars else None
+    for label in HEADER_LABELS + [label for label in column_map if label not in HEADER_LABELS]:
+        col_idx = column_map.get(label)
+        if label == "Date" and col_idx is None:
+            col_idx = 1
+        val = str(cells[col_idx]).strip() if col_idx is not None and col_idx < len(cells) else None
+        if not val or val.lower() == "nan":
+            row_data[label] = None
+        else:
+            if label not in TEXT_LABELS:
+                num = re.search(r"[-+]?\d+\.?\d*", val)
+                row_data[label] = float(num.group()) if num else None
+            else:
+                row_data[label] = val
+    return row_data
+
+
+def append_texture(row_data, extra_texture):
+    extra_texture = str(extra_texture).strip()
+    if extra_texture:
+        existing = row_data.get("Foam Texture", "")
+        row_data["Foam Texture"] = f"{existing}, {extra_texture}".strip(", ")
+
+
+# Extracted sample rows held column-wise: one list per field, in the order
+# fields are first seen, instead of a dict per row. Rows without a field get
+# NaN there, as with pd.DataFrame(list_of_dicts).
+class SampleColumns:
+    __slots__ = ("columns", "length", "_keys", "_targets")
+
+    def __init__(self):
+        self.columns = {}
+        self.length = 0
+        self._keys = None
+        self._targets = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        keys = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(keys, values))
+
+    # Column lists in the field order of `keys`, followed by those of the
+    # fields `keys` lacks (padded with NaN on append)
+    def _align(self, keys):
+        for key in keys:
+            if key not in self.columns:
+                self.columns[key] = [np.nan] * self.length
+        self._keys = keys
+        self._targets = [self.columns[key] for key in keys], [column for key, column in self.columns.items() if key not in keys]
+
+    def append(self, record):
+        keys = tuple(record)
+        if keys != self._keys:
+            self._align(keys)
+        present, missing = self._targets
+        for column, value in zip(present, record.values()):
+            column.append(value)
+        for column in missing:
+            column.append(np.nan)
+        self.length += 1
+
+    def extend(self, other):
+        if not isinstance(other, SampleColumns):
+            for record in other:
+                self.append(record)
+            return
+        for key, values in other.columns.items():
+            if key not in self.columns:
+                self.columns[key] = [np.nan] * self.length
+            self.columns[key].extend(values)
+        for key, column in self.columns.items():
+            if key not in other.columns:
+                column.extend([np.nan] * other.length)
+        self.length += other.length
+        self._keys = None
+
+    # DataFrame of the rows; each column list is released once converted,
+    # leaving the buffer empty
+    def to_frame(self):
+        series = {}
+        for key in list(self.columns):
+            series[key] = pd.Series(self.columns.pop(key))
+        self.length = 0
+        self._keys = None
+        return pd.DataFrame(series, copy=False)
+
+
+# Tag columns the walk reads, as arrays; the row text is only read on
+# dilution rows, so the other rows' text is not kept
+def _tag_arrays(tags):
+    arrays = {name: tags[name].to_numpy() for name in ["formulation", "day", "dilution", "header", "continuation", "first_column"]}
+    arrays["row_text"] = np.where(arrays["dilution"], tags["row_text"].to_numpy(), None)
+    arrays["candidate"] = tags["row_class"].isin(["formulation", "day", "dilution"]).to_numpy()
+    return arrays
+
+
+def _new_walk_state():
+    return {
+        "last_formulation": None,
+        "last_dilution": None,
+        "last_tube_volume": None,
+        "column_map": {},
+        "carry": 0,
+        "dilution_has_8c": np.nan,
+        "dilution_has_4c": np.nan,
+        "seen_ids": set(),
+    }
+
+
+# Walks rows [start, stop) of a classified sheet; `cells` may hold one extra
+# row past `stop` for lookahead. `state` is what the rows inherit from the
+# ones before them and is updated in place. Formulation IDs come from
+# `sample_ids` when given, otherwise from the text or the Sample_N fallback.
+# With records=False only the state is tracked and each walked formulation
+# row is reported with a snapshot of the state it starts from. Walked rows
+# are tallied per row class into `row_counts` and header texts no label
+# matched into the `unmapped_headers` Counter when given.
+def _walk_sheet(cells, tags, start, stop, state, sample_ids=None, records=True, row_counts=None, unmapped_headers=None):
+    samples = SampleColumns()
+    formulations = []
+    boundaries = []
+    counts = Counter()
+    n_rows = len(cells)
+    # Rows consumed by the walk of the rows before `start`
+    next_row = start + state.get("carry", 0)
+    sample_ids = iter(sample_ids) if sample_ids is not None else None
+    column_map = state["column_map"]
+
+    for row in start + np.flatnonzero(tags["candidate"][start:stop]):
+        # Rows already consumed as a header or texture continuation
+        if row < next_row:
+            continue
+        next_row = row + 1
+
+        # --- Formulation row detection ---
+        if tags["formulation"][row]:
+            counts["formulation"] += 1
+            cell = str(cells[row, 0]).strip()
+            if sample_ids is not None:
+                sample_id = next(sample_ids)
+            else:
+                sample_id = formulation_sample_id(cell) or f"Sample_{len(state['seen_ids'])+1}"
+                state["seen_ids"].add(sample_id)
+            if not records:
+                boundaries.append((row, sample_id, {key: state[key] for key in ["last_dilution", "last_tube_volume", "column_map"]}))
+                continue
+
+            s8, s4 = parse_stability(cells[row])
+            state["dilution_has_8c"] = s8
+            state["dilution_has_4c"] = s4
+            last_formulation = parse_formulation(cell)
+            last_formulation["SampleID"] = sample_id
+            state["last_formulation"] = last_formulation
+            formulations.append(last_formulation)
+
+            # 🔍 Check next row for dilution
+            if not (row + 1 < n_rows and tags["dilution"][row + 1]):
+                # If no dilution row follows, treat it as a single-row sample
+                samples.append(single_row_sample(sample_id, s8, s4))
+            continue
+
+        if tags["day"][row]:
+            counts["day"] += 1
+            if records:
+                row_data = parse_day_row(cells[row], column_map, state["last_formulation"], state["last_dilution"])
+            if row + 1 < n_rows and tags["continuation"][row + 1] and tags["first_column"][row + 1] == column_map.get("Foam Texture"):
+                if records:
+                    append_texture(row_data, cells[row + 1, tags["first_column"][row + 1]])
+                counts["continuation"] += 1
+                next_row = row + 2
+
+            if records:
+                row_data["Stable at 8C"] = state["dilution_has_8c"]
+                row_data["Stable at 4C"] = state["dilution_has_4c"]
+                row_data["Tube Volume (mL)"] = state["last_tube_volume"]
+                samples.append(row_data)
+            continue
+
+        if tags["dilution"][row]:
+            counts["dilution"] += 1
+            state["last_dilution"], state["last_tube_volume"] = parse_dilution_row(cells[row], DILUTION_PATTERN.search(tags["row_text"][row]))
+
+            # A header on the dilution row also holds the dilution labels,
+            # so only separate header rows are reported
+            if tags["header"][row]:
+                column_map = state["column_map"] = map_header_columns(cells[row])
+            elif row + 1 < n_rows and tags["header"][row + 1]:
+                column_map, unmapped = HEADER_MAPPER.map(cells[row + 1])
+                state["column_map"] = column_map
+                if unmapped_headers is not None:
+                    unmapped_headers.update(unmapped)
+                counts["header"] += 1
+                next_row = row + 2
+
+    state["carry"] = max(0, next_row - stop)
+    if row_counts is not None:
+        counts["skipped"] = min(stop, n_rows) - start - sum(counts.values())
+        for row_class in WALKED_ROW_CLASSES:
+            row_counts[row_class] = row_counts.get(row_class, 0) + counts[row_class]
+    return samples, formulations, boundaries
+
+
+# `row_counts`, when given, receives the number of formulation, dilution,
+# header, day, continuation and skipped rows, and `unmapped_headers` the
+# header texts no measurement label matched
+def extract_samples_complete_fixed(df, row_counts=None, unmapped_headers=None):
+    # Tagged before the object copy of the cells exists, so the two peaks
+    # do not add up
+    tags = _tag_arrays(classify_rows(df))
+    cells = df.to_numpy(dtype=object)
+    samples, formulation_records, _ = _walk_sheet(cells, tags, 0, len(cells), _new_walk_state(), row_counts=row_counts, unmapped_headers=unmapped_headers)
+    formulations = {}
+    for formulation in formulation_records:
+        formulations[formulation["SampleID"]] = formulation
+    return samples, formulations
+
+
+def _walk_block(args):
+    cells, tags, stop, state, sample_ids = args
+    samples, formulations, _ = _walk_sheet(cells, tags, 0, stop, state, sample_ids)
+    return samples, formulations
+
+
+# Tag arrays of a run of rows; classify_rows looks at each row on its own,
+# so chunks of a sheet can be tagged in worker processes
+def _classify_chunk(df):
+    return _tag_arrays(classify_rows(df))
+
+
+# Splits a sheet into runs of formulation blocks of at least `block_rows`
+# rows. A light sequential pass finds the formulation rows the walk reaches,
+# the SampleID each one gets and the dilution/header state it inherits, so
+# every block can be walked on its own. With an `executor` the rows are
+# classified in chunks of CLASSIFY_CHUNK_ROWS on its workers. Returns the
+# cells, the tag arrays and (start, stop, state, sample_ids) per block.
+def _sheet_blocks(df, block_rows, row_counts=None, unmapped_headers=None, executor=None):
+    n_rows = len(df)
+    if executor is None or n_rows <= CLASSIFY_CHUNK_ROWS:
+        tags = _classify_chunk(df)
+    else:
+        chunks = list(executor.map(_classify_chunk, [df.iloc[start:start + CLASSIFY_CHUNK_ROWS] for start in range(0, n_rows, CLASSIFY_CHUNK_ROWS)]))
+        tags = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    cells = df.to_numpy(dtype=object)
+    _, _, boundaries = _walk_sheet(cells, tags, 0, n_rows, _new_walk_state(), records=False, row_counts=row_counts, unmapped_headers=unmapped_headers)
+
+    # Rows before the first formulation form their own block
+    starts = [(0, {"last_dilution": None, "last_tube_volume": None, "column_map": {}})]
+    starts += [(row, inherited) for row, _, inherited in boundaries if row > 0]
+    block_starts = []
+    for start, inherited in starts:
+        if block_starts and start - block_starts[-1][0] < block_rows:
+            continue
+        block_starts.append((start, inherited))
+    boundary_rows = [row for row, _, _ in boundaries]
+
+    blocks = []
+    for i, (start, inherited) in enumerate(block_starts):
+        stop = block_starts[i + 1][0] if i + 1 < len(block_starts) else n_rows
+        state = _new_walk_state()
+        state.update(inherited)
+        sample_ids = [sample_id for _, sample_id, _ in boundaries[bisect_left(boundary_rows, start):bisect_left(boundary_rows, stop)]]
+        blocks.append((start, stop, state, sample_ids))
+    return cells, tags, blocks
+
+
+# Argument tuple for _walk_block; the block keeps one row past `stop` for lookahead
+def _block_job(cells, tags, block):
+    start, stop, state, sample_ids = block
+    block_tags = {name: values[start:stop + 1] for name, values in tags.items()}
+    return cells[start:stop + 1], block_tags, stop - start, state, sample_ids
+
+
+def _merge_blocks(results):
+    samples = SampleColumns()
     formulations = {}
-    row = 0
+    for block_samples, block_formulations in results:
+        samples.extend(block_samples)
+        for formulation in block_formulations:
+            formulations[formulation["SampleID"]] = formulation
+    return samples, formulations
+
+
+# Parallel form of extract_samples_complete_fixed for very large sheets: rows
+# are classified and runs of formulation blocks parsed in worker processes,
+# then merged back in sheet order, giving the same output as the sequential
+# path. Only the light state walk runs in the calling process.
+def extract_samples_parallel(df, workers=None, block_rows=20000, row_counts=None, unmapped_headers=None):
+    if len(df) <= block_rows:
+        return extract_samples_complete_fixed(df, row_counts, unmapped_headers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        cells, tags, blocks = _sheet_blocks(df, block_rows, row_counts, unmapped_headers, executor)
+        jobs = [_block_job(cells, tags, block) for block in blocks]
+        if len(jobs) == 1:
+            return _merge_blocks([_walk_block(jobs[0])])
+        return _merge_blocks(executor.map(_walk_block, jobs))
+
+
+# Positions of the formulation rows, from the first column alone (the same
+# test classify_rows uses)
+def _formulation_rows(df):
+    if df.shape[1] == 0:
+        return np.zeros(0, dtype=int)
+    first_cell = df.iloc[:, 0].astype(str).str.strip()
+    is_formulation = first_cell.str.contains(FORMULATION_PATTERN, na=False) & first_cell.str.contains("(", regex=False, na=False)
+    return np.flatnonzero(is_formulation.to_numpy())
+
+
+# What a block's walk depends on besides its rows: the SampleID it gives its
+# formulation row, the dilution/header state it inherits and, when its first
+# row is not a walked formulation row, the formulation it continues
+def _inherited_key(state, sample_id):
+    key = (sample_id, state["last_dilution"], state["last_tube_volume"], sorted(state["column_map"].items()), state["carry"])
+    if sample_id is None:
+        formulation = state["last_formulation"]
+        key += (formulation["SampleID"] if formulation else None, state["dilution_has_8c"], state["dilution_has_4c"])
+    return repr(key)
+
+
+# Incremental form of extract_samples_complete_fixed. The sheet is split at
+# formulation rows using only the first column and every block is
+# fingerprinted from hashes of its rows (plus the lookahead row). `store` (a
+# BlockStore) keeps each block's result with the state it inherited and the
+# state it hands on, so a block whose rows and inherited state are unchanged
+# is taken from the store; only the other blocks are classified and walked,
+# in runs of about CLASSIFY_CHUNK_ROWS rows. Counts of reused and parsed
+# blocks go to `stats`.
+def extract_samples_incremental(df, store, stats=None, row_counts=None, unmapped_headers=None):
+    n_rows = len(df)
+    formulation_rows = _formulation_rows(df).tolist() if n_rows else []
+    # Rows before the first formulation form their own block
+    starts = formulation_rows if formulation_rows[:1] == [0] else ([0] + formulation_rows if n_rows else [])
+    stops = starts[1:] + [n_rows]
+    is_formulation = set(formulation_rows)
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy() if n_rows else np.zeros(0, dtype=np.uint64)
+    prefix = f"{PARSER_VERSION}-{HEADER_MAPPER.fingerprint}-state".encode()
+    fingerprints = [hashlib.sha256(prefix + row_hashes[start:stop + 1].tobytes()).hexdigest() for start, stop in zip(starts, stops)]
+    cached = store.get_many(fingerprints)
+
+    state = _new_walk_state()
+    seen_ids = set()
+    first_cells = df.iloc[:, 0].to_numpy(dtype=object) if df.shape[1] else None
+    chunk_start = chunk_stop = 0
+    cells = tags = None
+    results = []
+    parsed = {}
+    for block, (start, stop, fingerprint) in enumerate(zip(starts, stops, fingerprints)):
+        sample_id = None
+        if start in is_formulation and not state["carry"]:
+            sample_id = formulation_sample_id(str(first_cells[start]).strip()) or f"Sample_{len(seen_ids) + 1}"
+            seen_ids.add(sample_id)
+        inherited = _inherited_key(state, sample_id)
+
+        entry = cached.get(fingerprint)
+        if entry is None or entry["inherited"] != inherited:
+            # Classify a run of rows from here on; the walk needs one row
+            # of lookahead past `stop`
+            if start < chunk_start or stop + 1 > chunk_stop:
+                chunk_start = start
+                chunk_stop = min(n_rows, max(stop + 1, start + CLASSIFY_CHUNK_ROWS))
+                chunk = df.iloc[chunk_start:chunk_stop]
+                tags = _tag_arrays(classify_rows(chunk))
+                cells = chunk.to_numpy(dtype=object)
+            block_counts = {}
+            block_unmapped = Counter()
+            walk_state = dict(state)
+            samples, formulations, _ = _walk_sheet(
+                cells, tags, start - chunk_start, stop - chunk_start, walk_state,
+                sample_ids=[sample_id] if sample_id is not None else [], row_counts=block_counts, unmapped_headers=block_unmapped,
+            )
+            entry = {
+                "inherited": inherited,
+                "result": (samples, formulations),
+                "state": {key: walk_state[key] for key in ["last_formulation", "last_dilution", "last_tube_volume", "column_map", "carry", "dilution_has_8c", "dilution_has_4c"]},
+                "row_counts": block_counts,
+                "unmapped_headers": block_unmapped,
+            }
+            cached[fingerprint] = parsed[fingerprint] = entry
+        results.append(entry["result"])
+        state.update(entry["state"])
+        if row_counts is not None:
+            for row_class, count in entry["row_counts"].items():
+                row_counts[row_class] = row_counts.get(row_class, 0) + count
+        if unmapped_headers is not None:
+            unmapped_headers.update(entry["unmapped_headers"])
+    store.put_many(parsed)
+
+    if stats is not None:
+        stats.update(blocks=len(starts), reused=len(starts) - len(parsed), parsed=len(parsed))
+    return _merge_blocks(results)
+
+
+# Parsed formulation blocks by fingerprint in SQLite; ":memory:" keeps them for
+# the life of the process only. Least recently used blocks beyond
+# `max_blocks` are dropped.
+class BlockStore:
+    def __init__(self, path=":memory:", max_blocks=200000):
+        self.max_blocks = max_blocks
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blocks (fingerprint TEXT PRIMARY KEY, payload BLOB, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blocks_last_used ON blocks (last_used)")
+
+    def get_many(self, fingerprints):
+        found = {}
+        unique = list(dict.fromkeys(fingerprints))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT fingerprint, payload FROM blocks WHERE fingerprint IN ({marks})", chunk)
+                found.update((fingerprint, pickle.loads(payload)) for fingerprint, payload in rows)
+                self._conn.execute(f"UPDATE blocks SET last_used = ? WHERE fingerprint IN ({marks})", [time.time()] + chunk)
+            self._conn.commit()
+        return found
+
+    def put_many(self, blocks):
+        if not blocks:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)",
+                [(fingerprint, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), now) for fingerprint, result in blocks.items()],
+            )
+            self._conn.execute(
+                "DELETE FROM blocks WHERE fingerprint IN (SELECT fingerprint FROM blocks ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_blocks,),
+            )
+            self._conn.commit()
+
+
+# Streaming variant of extract_samples_complete_fixed: consumes any iterator
+# of rows (e.g. csv.reader) with one row of lookahead and yields
+# ("formulation", record) and ("sample", record) pairs as soon as they are
+# complete. Blank lines are skipped like pd.read_csv does. Header texts no
+# measurement label matched go to the `unmapped_headers` Counter when given.
+def iter_samples(rows, unmapped_headers=None):
+    rows = (cells for cells in rows if len(cells))
+    seen_ids = set()
     last_formulation = None
     last_dilution = None
     last_tube_volume = None
     column_map = {}
-    current_dilution_rows = []
-
     dilution_has_8c = np.nan
     dilution_has_4c = np.nan
 
-    def flush_current_dilution():
-        for row_data in current_dilution_rows:
-            row_data["Stable at 8C"] = dilution_has_8c
-            row_data["Stable at 4C"] = dilution_has_4c
-            row_data["Tube Volume (mL)"] = last_tube_volume
-            samples.append(row_data)
-        current_dilution_rows.clear()
-
-    def parse_formulation(text):
-        data = {
-            "SampleID": re.search(r"\((.*?)\)", text).group(1).strip() if re.search(r"\((.*?)\)", text) else None
-        }
-        seen_keys_lower = set()
-        for p in re.split(r'[,-]', text):
-            p = p.strip()
-            ppm_match = re.match(r"(\d+\.?\d*)\s*ppm\s*(.*)", p, re.IGNORECASE)
-            if ppm_match:
-                val, chem = ppm_match.groups()
-                chem = re.sub(r"\(.*?\)", "", chem).strip()
-                chem_key = f"{chem} (ppm)"
-                if chem_key.lower() not in seen_keys_lower:
-                    data[chem_key] = float(val)
-                    seen_keys_lower.add(chem_key.lower())
-                continue
-            percent_match = re.match(r"(\d+\.?\d*)%\s*(.*)", p, re.IGNORECASE)
-            if percent_match:
-                val, chem = percent_match.groups()
-                chem = re.sub(r"\(.*?\)", "", chem).strip()
-                chem_key = f"{chem} (%)"
-                if chem_key.lower() not in seen_keys_lower:
-                    data[chem_key] = float(val)
-                    seen_keys_lower.add(chem_key.lower())
-        return data
-
-    while row < df.shape[0]:
-        cell = str(df.iat[row, 0]).strip()
+    def row_text(cells):
+        return ",".join("" if is_missing(val) else str(val) for val in cells).lower()
 
-        # --- Formulation row detection ---
-        if any(sym in cell.lower() for sym in ["%", "ppm"]) and "(" in cell:
-            flush_current_dilution()
-            formulation_text = cell.lower()
-
-            # Detect stability
-            s8, s4 = np.nan, np.nan
-            if "unstable concentrate" in formulation_text:
-                s8 = False
-                s4 = False
-
-            values_to_check = [
-                str(df.iat[row, col]).lower().strip()
-                for col in range(1, min(11, df.shape[1]))
-                if pd.notna(df.iat[row, col])
-            ]
-            for val in values_to_check:
-                if "unstable concentrate" in val:
-                    s4 = False
-                    s8 = False
-                if "unstable at 4c" in val:
-                    s4 = False
-                elif "stable at 4c" in val and s4 is not False:
-                    s4 = True
-                if "unstable at 8c" in val:
-                    s8 = False
-                elif "stable at 8c" in val and s8 is not False:
-                    s8 = True
+    cells = next(rows, None)
+    lookahead = next(rows, None)
+    while cells is not None:
+        consumed_lookahead = False
+        cell = str(cells[0]).strip()
 
+        if FORMULATION_PATTERN.search(cell) and "(" in cell:
+            s8, s4 = parse_stability(cells)
             dilution_has_8c = s8
             dilution_has_4c = s4
 
             last_formulation = parse_formulation(cell)
             if not last_formulation.get("SampleID"):
-                fallback_id = f"Sample_{len(formulations)+1}"
-                last_formulation["SampleID"] = fallback_id
-            formulations[last_formulation["SampleID"]] = last_formulation
+                last_formulation["SampleID"] = f"Sample_{len(seen_ids)+1}"
+            seen_ids.add(last_formulation["SampleID"])
+            yield "formulation", last_formulation
 
-            # 🔍 Check next row for dilution
-            next_row_text = ",".join(df.iloc[row + 1].fillna("").astype(str)).lower() if row + 1 < df.shape[0] else ""
-            if not re.search(r"\d+\s*x", next_row_text):
-                # If no dilution row follows, treat it as a single-row sample
-                samples.append({
-                    "SampleID": last_formulation["SampleID"],
-                    "Dilution": None,
-                    "Day": None,
-                    "Foam (cc)": None,
-                    "Foam Texture": None,
-                    "Water (cc) (cc)": None,
-                    "Zeta": None,
-                    "Conductivity": None,
-                    "Size": None,
-                    "PI": None,
-                    "Baseline": None,
-                    "Date": None,
-                    "Stable at 8C": s8,
-                    "Stable at 4C": s4,
-                    "Tube Volume (mL)": None
-                })
-
-            row += 1
-            continue
+            if lookahead is None or not DILUTION_PATTERN.search(row_text(lookahead)):
+                yield "sample", single_row_sample(last_formulation["SampleID"], s8, s4)
 
-        if re.match(r"Day\s*\d+", cell, re.IGNORECASE):
-            row_data = {"SampleID": last_formulation["SampleID"]} if last_formulation else {}
-            row_data["Dilution"] = last_dilution
-            row_data["Day"] = cell.strip()
-            stars = ["*" for i in range(column_map.get("Foam Texture", 0) + 1, df.shape[1]) if "*" in str(df.iat[row, i])]
-            row_data["Baseline"] = ", ".join(stars) if stars else None
-            for offset, label in enumerate(["Date", "Foam (cc)", "Foam Texture", "Water (cc)", "Zeta", "Conductivity", "Size", "PI"]):
-                col_idx = column_map.get(label)
-                if label == "Date" and col_idx is None:
-                    col_idx = 1
-                val = str(df.iat[row, col_idx]).strip() if col_idx is not None and col_idx < df.shape[1] else None
-                if not val or val.lower() == "nan":
-                    row_data[label] = None
-                else:
-                    if label in ["Foam (cc)", "Water (cc)", "Zeta", "Conductivity", "Size", "PI"]:
-                        num = re.search(r"[-+]?\d+\.?\d*", val)
-                        row_data[label] = float(num.group()) if num else None
-                    else:
-                        row_data[label] = val
-
-            if row + 1 < df.shape[0]:
-                next_row = df.iloc[row + 1]
-                non_empty = next_row.dropna()
-                if len(non_empty) == 1 and column_map.get("Foam Texture") in non_empty.index:
-                    extra_texture = str(non_empty.values[0]).strip()
-                    if extra_texture:
-                        existing = row_data.get("Foam Texture", "")
-                        row_data["Foam Texture"] = f"{existing}, {extra_texture}".strip(", ")
-                    row += 1
-
-            current_dilution_rows.append(row_data)
-            row += 1
-            continue
+        elif DAY_PATTERN.match(cell):
+            row_data = parse_day_row(cells, column_map, last_formulation, last_dilution)
+            if lookahead is not None and column_map.get("Foam Texture") is not None:
+                non_empty = [i for i, val in enumerate(lookahead) if not is_missing(val)]
+                if non_empty == [column_map["Foam Texture"]]:
+                    append_texture(row_data, lookahead[non_empty[0]])
+                    consumed_lookahead = True
+            row_data["Stable at 8C"] = dilution_has_8c
+            row_data["Stable at 4C"] = dilution_has_4c
+            row_data["Tube Volume (mL)"] = last_tube_volume
+            yield "sample", row_data
 
-        row_text_combined = ",".join(df.iloc[row].fillna("").astype(str)).lower()
-        dilution_search = re.search(r"(\d+\s*X)", row_text_combined, re.IGNORECASE)
-        if dilution_search:
-            flush_current_dilution()
-            base_dilution = dilution_search.group(1).replace(" ", "").upper()
-            extra_label = []
-            tube_volume = ""
-
-            for col in range(1, 6):
-                if col < df.shape[1]:
-                    val = str(df.iat[row, col]).strip()
-                    if val and val.lower() != "nan":
-                        if "ml" in val.lower():
-                            tube_volume = val
-                        else:
-                            extra_label.append(val)
-
-            last_dilution = base_dilution + (" " + " ".join(extra_label) if extra_label else "")
-            last_tube_volume = tube_volume
-
-            if "foam" in row_text_combined:
-                header_row = df.iloc[row]
-                row += 1
-            elif row + 1 < df.shape[0] and "foam" in ",".join(df.iloc[row + 1].fillna("").astype(str)).lower():
-                header_row = df.iloc[row + 1]
-                row += 2
-            else:
-                row += 1
-                continue
+        else:
+            text = row_text(cells)
+            dilution_search = DILUTION_PATTERN.search(text)
+            if dilution_search:
+                last_dilution, last_tube_volume = parse_dilution_row(cells, dilution_search)
+                if "foam" in text:
+                    column_map = map_header_columns(cells)
+                elif lookahead is not None and "foam" in row_text(lookahead):
+                    column_map, unmapped = HEADER_MAPPER.map(lookahead)
+                    if unmapped_headers is not None:
+                        unmapped_headers.update(unmapped)
+                    consumed_lookahead = True
 
-            column_map = {}
-            for i, val in header_row.items():
-                val = str(val).strip().lower()
-                if "foam amount" in val or ("foam" in val and "cc" in val):
-                    column_map["Foam (cc)"] = i
-                elif "foam texture" in val or "texture" in val:
-                    column_map["Foam Texture"] = i
-                elif "zeta" in val:
-                    column_map["Zeta"] = i
-                elif "pi" in val:
-                    column_map["PI"] = i
-                elif "conductivity" in val:
-                    column_map["Conductivity"] = i
-                elif "size" in val:
-                    column_map["Size"] = i
-                elif "Water (cc)" in val:
-                    column_map["Water (cc)"] = i
-                elif "date" in val:
-                    column_map["Date"] = i
-            continue
+        if consumed_lookahead:
+            lookahead = next(rows, None)
+        cells = lookahead
+        lookahead = next(rows, None)
 
-        row += 1
 
-    flush_current_dilution()
+def iter_samples_from_csv(path, encoding="utf-8"):
+    with open(path, newline="", encoding=encoding) as handle:
+        yield from iter_samples(csv.reader(handle))
+
+
+# Collect iter_samples output into the (samples, formulations) pair returned
+# by extract_samples_complete_fixed
+def collect_samples(records):
+    samples = SampleColumns()
+    formulations = {}
+    for kind, record in records:
+        if kind == "formulation":
+            formulations[record["SampleID"]] = record
+        else:
+            samples.append(record)
     return samples, formulations
 
 
@@ -215,7 +785,7 @@ def process_dilution(dilution):
     sonic=np.nan
 
     if pd.isna(dilution):
-        return pilot, temp_foam, ini_foam, dilution
+        return pilot, temp_foam, ini_foam, dilution, ratio, sonic
 
     text = str(dilution)
 
@@ -252,9 +822,940 @@ def process_dilution(dilution):
     cleaned_text = text.strip(" ,;-").strip()
     return pilot, temp_foam, ini_foam, cleaned_text, ratio, sonic
 
+
+# Batch form of process_dilution: every distinct dilution string is parsed
+# once with column-wise extracts and the results are broadcast back to the
+# rows of `dilutions`.
+def process_dilutions(dilutions):
+    dilutions = pd.Series(dilutions)
+    codes, uniques = pd.factorize(dilutions)
+    text = pd.Series(uniques, dtype=object).astype(str)
+
+    pilot = pd.Series(np.nan, index=text.index, dtype=object)
+    pilot[text.str.contains("AFC", regex=False)] = "AFC"
+
+    sonic = pd.Series(np.nan, index=text.index, dtype=object)
+    sonic[text.str.contains(r"no\s*sonic", case=False, regex=True)] = False
+    sonic[text.str.contains("sonicated", case=False, regex=False)] = True
+
+    ratio_parts = text.str.extract(r"\(?(\d):(\d)\)?\s*ratio", flags=re.IGNORECASE).astype(float)
+    ratio = (ratio_parts[1] / ratio_parts[0].where(ratio_parts[0] != 0)).round(3)
+
+    table = pd.DataFrame({
+        "Pilot": pilot,
+        "Temp Foam Monitoring": text.str.extract(r"(\d+)\s*c(?!c)", flags=re.IGNORECASE)[0].astype(float),
+        "Initial Foam Volume (cc)": text.str.extract(r"(\d+)\s*cc", flags=re.IGNORECASE)[0].astype(object).fillna("5cc"),
+        "Dilution": text.str.strip(" ,;-").str.strip().astype(object),
+        "Ratio": ratio,
+        "Sonicated": sonic,
+    })
+    # Missing dilutions have code -1 and come back as an all-NaN row
+    result = table.reindex(codes)
+    result["Initial Foam Volume (cc)"] = result["Initial Foam Volume (cc)"].fillna("5cc")
+    result.index = dilutions.index
+    return result
+
+
+WIDE_EXCLUDED_COLUMNS = ["SampleID", "Day", "Day_Num", "Foam (cc)", "Foam Texture", "Date", "Baseline", "Pilot"]
+
+
+# One row per (SampleID, Dilution) with "Day N - Amount (cc)" / "Day N - Foam
+# Texture" columns for every day up to the last one seen. Formulation columns
+# take the first non-null value of the group and each day the first row
+# recorded for it.
+def build_wide_table(final_df):
+    keys = ["SampleID", "Dilution"]
+    # One filtered copy of the table; the per-day lookups only carry the
+    # columns they need
+    df_input = final_df[(final_df["Day"].notna() & final_df[keys].notna().all(axis=1)).to_numpy()]
+    day_num = df_input["Day"].astype(str).str.extract(r'(\d+)', expand=False).astype(int)
+    formulation_cols = [col for col in df_input.columns if col not in WIDE_EXCLUDED_COLUMNS + keys]
+
+    grouped = df_input.groupby(keys, sort=True)
+    wide = grouped[formulation_cols].first()
+    wide = wide.mask(wide.isna(), np.nan)
+
+    day_rows = df_input[keys + ["Date", "Foam (cc)", "Foam Texture"]].assign(Day_Num=day_num)
+    first_per_day = day_rows.drop_duplicates(keys + ["Day_Num"])
+    wide["Date"] = first_per_day[first_per_day["Day_Num"] == 0].set_index(keys)["Date"].reindex(wide.index)
+    has_star = df_input["Baseline"].astype(str).str.contains(r"\*", na=False)
+    wide["Baseline"] = np.where(has_star.groupby([df_input["SampleID"], df_input["Dilution"]]).any(), "*", "")
+    wide["Pilot"] = grouped["Pilot"].first().fillna("")
+
+    days = range(day_num.max() + 1) if not df_input.empty else range(0)
+    first_per_day = first_per_day.set_index(keys + ["Day_Num"])
+    amounts = first_per_day["Foam (cc)"].unstack("Day_Num").reindex(index=wide.index, columns=days)
+    textures = first_per_day["Foam Texture"].unstack("Day_Num").reindex(index=wide.index, columns=days)
+    recorded = pd.Series(True, index=first_per_day.index).unstack("Day_Num", fill_value=False)
+    recorded = recorded.reindex(index=wide.index, columns=days, fill_value=False)
+    textures = textures.astype(object).where(recorded, "")
+
+    day_columns = {}
+    for day in days:
+        day_columns[f"Day {day} - Amount (cc)"] = amounts[day]
+        day_columns[f"Day {day} - Foam Texture"] = textures[day]
+    wide = pd.concat([wide, pd.DataFrame(day_columns, index=wide.index)], axis=1)
+    return wide.reset_index()
+
+
+# Day columns differ between concatenated wide tables; keep them last and in
+# day order
+def order_wide_columns(wide_df):
+    day_cols = [col for col in wide_df.columns if str(col).startswith("Day ") and " - " in str(col)]
+    day_cols.sort(key=lambda col: (int(col.split()[1]), "Texture" in col))
+    other_cols = [col for col in wide_df.columns if col not in day_cols]
+    return wide_df[other_cols + day_cols]
+
+
+# Row positions of `df` to display: rows whose `filter_column` contains
+# `filter_text` (case-insensitive), ordered by `sort_by`. Only the sort and
+# filter columns are touched, so a page can be cut with df.iloc afterwards
+# without copying the whole table.
+def table_positions(df, sort_by=None, ascending=True, filter_column=None, filter_text=""):
+    positions = np.arange(len(df))
+    if filter_column is not None and filter_text:
+        matches = df[filter_column].astype(str).str.contains(filter_text, case=False, regex=False, na=False)
+        positions = np.flatnonzero(matches.to_numpy())
+    if sort_by is not None:
+        values = df[sort_by].iloc[positions].reset_index(drop=True)
+        try:
+            order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index
+        except TypeError:
+            # Mixed text and numbers in one column
+            order = values.where(values.isna(), values.astype(str)).sort_values(ascending=ascending, kind="stable", na_position="last").index
+        positions = positions[order.to_numpy()]
+    return positions
+
+
+# Rows, recorded days, first and last day and last foam amount per
+# SampleID/Dilution
+def sample_summary(final_df):
+    keys = ["SampleID", "Dilution"]
+    day_num = pd.to_numeric(final_df["Day"].astype(str).str.extract(r"(\d+)", expand=False), errors="coerce")
+    days = final_df[keys + ["Foam (cc)"]].assign(Day_Num=day_num)
+    grouped = days.groupby(keys, dropna=False, sort=True)
+    summary = grouped.agg(Rows=("Day_Num", "size"), Days=("Day_Num", "count"), **{"First Day": ("Day_Num", "min"), "Last Day": ("Day_Num", "max")})
+    last_rows = days.dropna(subset=["Day_Num"]).sort_values("Day_Num", kind="stable").drop_duplicates(keys, keep="last").set_index(keys)
+    summary["Last Foam (cc)"] = last_rows["Foam (cc)"].reindex(summary.index)
+    return summary.reset_index()
+
+
+# Value at the first position of every group in `groups` (group codes
+# sorted ascending), NaN for groups that never occur
+def _first_per_group(groups, values, n_groups):
+    first = np.full(n_groups, np.nan)
+    if len(groups):
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        first[groups[starts]] = values[starts]
+    return first
+
+
+# Stability metrics per SampleID/Dilution from the recorded days, computed
+# for all groups at once on sorted arrays:
+# - Decay Rate (1/day), Half-life (days) and Decay Fit R²: least-squares fit
+#   of ln(foam) over the days with foam above zero (foam = V0 * exp(-rate * day));
+#   no half-life when the foam does not decay
+# - Foam AUC (cc·day): trapezoids between recorded days, so missing days are
+#   bridged by a straight line
+# - Below Threshold Day: first day with foam under `threshold` cc, or under
+#   half the first reading when no threshold is given
+# - Texture Change Day: first day whose texture differs from the first one
+#   recorded
+# Like the wide table, only the first row recorded for a day is used. Rows of
+# different sheets or source files are kept apart.
+def foam_decay_metrics(final_df, threshold=None):
+    keys = [column for column in ("Source File", "Sheet") if column in final_df.columns] + ["SampleID", "Dilution"]
+    texture = final_df["Foam Texture"].astype(str).str.strip().str.lower()
+    points = pd.DataFrame({
+        **{key: final_df[key] for key in keys},
+        "Day_Num": pd.to_numeric(final_df["Day"].astype(str).str.extract(r"(\d+)", expand=False), errors="coerce"),
+        "Foam": pd.to_numeric(final_df["Foam (cc)"], errors="coerce"),
+        "Texture": texture.where(final_df["Foam Texture"].notna() & (texture != "")),
+    })
+    points = points.dropna(subset=keys + ["Day_Num"]).drop_duplicates(keys + ["Day_Num"])
+    grouped = points.groupby(keys, sort=True)
+    index = grouped.size().index
+    n_groups = len(index)
+
+    codes = grouped.ngroup().to_numpy()
+    order = np.lexsort((points["Day_Num"].to_numpy(), codes))
+    groups = codes[order]
+    days = points["Day_Num"].to_numpy(dtype=float)[order]
+    foam = points["Foam"].to_numpy(dtype=float)[order]
+    texture_codes = pd.factorize(points["Texture"])[0][order]
+
+    recorded = ~np.isnan(foam)
+    g, t, v = groups[recorded], days[recorded], foam[recorded]
+    initial = _first_per_group(g, v, n_groups)
+
+    # ln(foam) = ln(V0) - rate * day by least squares, from per-group sums
+    fit = v > 0
+    y = np.log(v, where=fit, out=np.zeros_like(v))
+    sums = [np.bincount(g[fit], weights, minlength=n_groups) for weights in (None, t[fit], y[fit], t[fit] ** 2, t[fit] * y[fit], y[fit] ** 2)]
+    n, st, sy, stt, sty, syy = sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_spread = n * stt - st ** 2
+        y_spread = n * syy - sy ** 2
+        slope = np.where((n >= 2) & (t_spread > 0), (n * sty - st * sy) / t_spread, np.nan)
+        r_squared = np.where(y_spread > 1e-12, (n * sty - st * sy) ** 2 / (t_spread * y_spread), np.nan)
+        rate = -slope
+        half_life = np.where(rate > 0, np.log(2) / rate, np.nan)
+
+    same_group = g[1:] == g[:-1]
+    areas = np.diff(t) * (v[1:] + v[:-1]) / 2
+    auc = np.bincount(g[1:][same_group], areas[same_group], minlength=n_groups)
+    counts = np.bincount(g, minlength=n_groups)
+
+    limit = initial[g] / 2 if threshold is None else threshold
+    below = v < limit
+    below_day = _first_per_group(g[below], t[below], n_groups)
+
+    has_texture = texture_codes >= 0
+    first_texture = _first_per_group(groups[has_texture], texture_codes[has_texture], n_groups)
+    changed = has_texture & (texture_codes != first_texture[groups])
+    texture_day = _first_per_group(groups[changed], days[changed], n_groups)
+
+    metrics = index.to_frame(index=False)
+    metrics["Foam Days"] = counts
+    metrics["Initial Foam (cc)"] = initial
+    metrics["Decay Rate (1/day)"] = rate
+    metrics["Half-life (days)"] = half_life
+    metrics["Decay Fit R²"] = r_squared
+    metrics["Foam AUC (cc·day)"] = np.where(counts >= 2, auc, np.nan)
+    metrics["Below Threshold Day"] = pd.array(below_day).astype("Int64")
+    metrics["Texture Change Day"] = pd.array(texture_day).astype("Int64")
+    return metrics
+
+
+# "AFC" where the dilution label mentions AFC, set in place
 def assign_pilot_column(df):
-    df["Pilot"] = df["SampleID"].apply(lambda x: "AFC" if pd.notna(x) and "AFC" in str(x).upper() else None)
-    df["Pilot"] = df["Dilution"].apply(lambda x: "AFC" if pd.notna(x) and "AFC" in str(x).upper() else None)
+    dilution = df["Dilution"]
+    is_afc = dilution.notna() & dilution.astype(str).str.upper().str.contains("AFC", regex=False)
+    df["Pilot"] = pd.Series("AFC", index=df.index).where(is_afc)
 
     return df
 
+
+# Bump whenever parsing output changes so cached results are not reused
+PARSER_VERSION = "6"
+
+
+def upload_encoding(data):
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+
+def read_preview(data):
+    return pd.read_csv(io.BytesIO(data), encoding=upload_encoding(data))
+
+
+def read_raw_sheet(data):
+    return pd.read_csv(io.BytesIO(data), header=None, encoding=upload_encoding(data))
+
+
+# Wall time and (with track_memory) peak traced memory of each pipeline
+# stage. Stages are recorded in order as dicts with "stage", "seconds",
+# "peak_mb" and "rows"; the extract stage also gets "row_classes", the
+# number of sheet rows of each class. With a `logger` every finished stage
+# is also logged as one JSON line.
+class PipelineProfile:
+    def __init__(self, track_memory=False, logger=None):
+        self.track_memory = track_memory
+        self.logger = logger
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = {"stage": name, "seconds": None, "peak_mb": None, "rows": None}
+        started_tracing = False
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.track_memory:
+                record["peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 1e6
+                if started_tracing:
+                    tracemalloc.stop()
+            self.stages.append(record)
+            if self.logger is not None:
+                self.logger.info(json.dumps({"event": "parse_stage", **record}))
+
+
+def _stage(profile, name):
+    return profile.stage(name) if profile is not None else contextlib.nullcontext({})
+
+
+# Long table of one sheet: samples merged with their formulation columns and
+# the derived dilution fields. `extract` defaults to
+# extract_samples_complete_fixed; stages are timed when `profile` is given.
+def build_final_df(df_input, extract=None, profile=None, unmapped_headers=None):
+    extract = extract or extract_samples_complete_fixed
+    with _stage(profile, "extract") as record:
+        options = {} if unmapped_headers is None else {"unmapped_headers": unmapped_headers}
+        if profile is not None:
+            record["row_classes"] = options["row_counts"] = {}
+        samples, formulations = extract(df_input, **options)
+        record["rows"] = len(samples)
+    return assemble_final_df(samples, formulations, profile)
+
+
+# Long table from extracted samples and formulations (the stages after
+# extraction in build_final_df)
+def assemble_final_df(samples, formulations, profile=None):
+    with _stage(profile, "dataframe") as record:
+        df_samples = samples.to_frame() if isinstance(samples, SampleColumns) else pd.DataFrame(samples)
+        df_formulations = pd.DataFrame.from_dict(formulations, orient="index")
+        df_formulations["SampleID"] = df_formulations.index
+        record["rows"] = len(df_samples)
+    with _stage(profile, "merge") as record:
+        final_df = df_samples.merge(df_formulations, on="SampleID", how="left")
+        record["rows"] = len(final_df)
+
+    with _stage(profile, "dilution") as record:
+        # Create the new columns with default NaN
+        final_df["Initial Foam Volume (cc)"] = "5cc"  # Set default value
+        final_df["Pilot"] = np.nan
+        final_df["Temp Foam Monitoring"] = np.nan
+        final_df["Initial Foam Temp"] = np.nan  # No logic yet, reserved
+        if "Water (cc)" not in final_df.columns:
+            final_df["Water (cc)"] = np.nan
+        final_df["Sonicated"] = np.nan
+
+        # Apply the processing
+        dilution_fields = process_dilutions(final_df["Dilution"])
+        final_df[list(dilution_fields.columns)] = dilution_fields
+        final_df["Tube Volume (mL)"] = final_df["Tube Volume (mL)"].astype(str).str.replace(r"mL\s*tube", "", case=False, regex=True).str.strip()
+        record["rows"] = final_df["Dilution"].nunique()
+    with _stage(profile, "pilot"):
+        final_df = assign_pilot_column(final_df)
+    with _stage(profile, "dedupe") as record:
+        # Rows can only repeat if their key columns do, so the full-width
+        # comparison runs on those candidates and the table is only copied
+        # when there is something to drop
+        key_columns = [col for col in ["SampleID", "Dilution", "Day", "Date", "Foam (cc)"] if col in final_df.columns]
+        candidates = np.flatnonzero(final_df[key_columns].duplicated(keep=False).to_numpy())
+        if len(candidates):
+            duplicated = final_df.iloc[candidates].duplicated().to_numpy()
+            if duplicated.any():
+                final_df = final_df.drop(index=final_df.index[candidates[duplicated]])
+
+        final_df["time"] = None
+        # None -> NaN, rewriting only the columns that hold a None
+        object_columns = final_df.columns[(final_df.dtypes == object).to_numpy()]
+        with_none = [column for column in object_columns if final_df[column].map(lambda value: value is None).any()]
+        if with_none:
+            final_df[with_none] = final_df[with_none].replace({None: np.nan})
+        record["rows"] = len(final_df)
+    return final_df
+
+
+# Full pipeline for an uploaded CSV: long table, per-day wide table and
+# their CSV downloads. With a BlockStore only changed formulation blocks are
+# re-parsed; stages are timed when `profile` is given.
+def parse_foam_csv(data, block_store=None, profile=None):
+    with _stage(profile, "read") as record:
+        df_input = read_raw_sheet(data)
+        record["rows"] = len(df_input)
+    block_stats = {}
+    extract = None
+    if block_store is not None:
+        extract = partial(extract_samples_incremental, store=block_store, stats=block_stats)
+    unmapped_headers = Counter()
+    final_df = build_final_df(df_input, extract, profile, unmapped_headers)
+    with _stage(profile, "pivot") as record:
+        wide_df = build_wide_table(final_df)
+        record["rows"] = len(wide_df)
+    return _parse_result(final_df, wide_df, block_stats, profile, unmapped_headers)
+
+
+# Downloads and search index shared by parse_foam_csv and parse_foam_xlsx
+def _parse_result(final_df, wide_df, block_stats, profile, unmapped_headers=None):
+    with _stage(profile, "export"):
+        csv_bytes = export_table(final_df, "csv")
+        wide_csv_bytes = export_table(wide_df, "csv")
+    with _stage(profile, "index"):
+        sample_index = SampleIndex(final_df)
+    with _stage(profile, "composition"):
+        composition = CompositionMatrix(final_df)
+    return {
+        "block_stats": block_stats,
+        "final_df": final_df,
+        "wide_df": wide_df,
+        "csv": csv_bytes,
+        "wide_csv": wide_csv_bytes,
+        "index": sample_index,
+        "composition": composition,
+        "unmapped_headers": dict((unmapped_headers or Counter()).most_common()),
+        "profile": profile.stages if profile is not None else None,
+    }
+
+
+# openpyxl cell value -> what the CSV export of the sheet would hold
+def _xlsx_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        date = f"{value.month}/{value.day}/{value.year}"
+        return date if value.time() == datetime.time() else f"{date} {value:%H:%M:%S}"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def xlsx_sheet_names(data):
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+# Rows of one worksheet as lists of strings, streamed in read-only mode so
+# only the current row is held in memory
+def iter_xlsx_rows(data, sheet_name):
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        for row in workbook[sheet_name].iter_rows(values_only=True):
+            yield [_xlsx_cell(value) for value in row]
+    finally:
+        workbook.close()
+
+
+# First `max_rows` rows of the first worksheet, first row as header like
+# read_preview
+def read_xlsx_preview(data, max_rows=1000):
+    preview = pd.DataFrame(list(islice(iter_xlsx_rows(data, xlsx_sheet_names(data)[0]), max_rows + 1)))
+    if preview.empty:
+        return preview
+    preview.columns = [name if name else f"Unnamed: {i}" for i, name in enumerate(preview.iloc[0].fillna(""))]
+    return preview.iloc[1:].reset_index(drop=True)
+
+
+_worker_workbook = None
+
+
+def _set_worker_workbook(data):
+    global _worker_workbook
+    _worker_workbook = data
+
+
+# Long and wide tables of one worksheet, tagged with its name, and its
+# unmapped header texts; sheets without samples (notes, charts) give None
+# tables
+def parse_xlsx_sheet(sheet_name, data=None):
+    unmapped_headers = Counter()
+    samples, formulations = collect_samples(iter_samples(iter_xlsx_rows(data or _worker_workbook, sheet_name), unmapped_headers))
+    if not samples:
+        return sheet_name, None, None, unmapped_headers
+    final_df = assemble_final_df(samples, formulations)
+    wide_df = build_wide_table(final_df)
+    final_df.insert(0, "Sheet", sheet_name)
+    wide_df.insert(0, "Sheet", sheet_name)
+    return sheet_name, final_df, wide_df, unmapped_headers
+
+
+# Tables of every worksheet, parsed in `workers` processes (each streaming
+# its own sheet) and concatenated in workbook order. Unmapped header texts of
+# all sheets are added to the `unmapped_headers` Counter when given.
+def parse_xlsx_sheets(data, workers=None, unmapped_headers=None):
+    sheet_names = xlsx_sheet_names(data)
+    if workers == 1 or len(sheet_names) == 1:
+        results = [parse_xlsx_sheet(name, data) for name in sheet_names]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_workbook, initargs=(data,)) as executor:
+            results = list(executor.map(parse_xlsx_sheet, sheet_names))
+    if unmapped_headers is not None:
+        for result in results:
+            unmapped_headers.update(result[3])
+    results = [result for result in results if result[1] is not None]
+    if not results:
+        raise ValueError("No samples found in any worksheet")
+    final_df = pd.concat([final_df for _, final_df, _, _ in results], ignore_index=True)
+    wide_df = order_wide_columns(pd.concat([wide_df for _, _, wide_df, _ in results], ignore_index=True))
+    return final_df, wide_df
+
+
+# parse_foam_csv for an .xlsx workbook: one "Sheet"-tagged result over all
+# worksheets
+def parse_foam_xlsx(data, workers=None, profile=None):
+    unmapped_headers = Counter()
+    with _stage(profile, "sheets") as record:
+        final_df, wide_df = parse_xlsx_sheets(data, workers, unmapped_headers)
+        record["rows"] = len(final_df)
+    return _parse_result(final_df, wide_df, {}, profile, unmapped_headers)
+
+
+MEASUREMENT_COLUMNS = [
+    "Foam (cc)", "Water (cc)", "Water (cc) (cc)", "Zeta", "Conductivity", "Size", "PI",
+    "Temp Foam Monitoring", "Initial Foam Temp", "Initial Foam Volume (cc)", "Ratio", "Tube Volume (mL)", "time",
+]
+BOOLEAN_COLUMNS = ["Stable at 8C", "Stable at 4C", "Sonicated"]
+DATE_COLUMNS = ["Date"]
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Feather": ("feather", "application/vnd.apache.arrow.file"),
+}
+
+
+# Typed copy of a long or wide table for columnar export: float32 for
+# measurements and chemical amounts ("5cc" -> 5.0), nullable booleans for the
+# stability and sonication flags, parsed dates and categoricals for every
+# other text column.
+def apply_output_schema(df):
+    typed = {}
+    for col in df.columns:
+        values = df[col]
+        name = str(col)
+        if name in BOOLEAN_COLUMNS:
+            typed[col] = values.astype(object).where(values.notna(), None).astype("boolean")
+        elif name in DATE_COLUMNS:
+            typed[col] = pd.to_datetime(values, errors="coerce", format="mixed")
+        elif name in MEASUREMENT_COLUMNS or name.endswith((" (%)", " (ppm)", " - Amount (cc)")):
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values.astype(str).str.extract(r"([-+]?\d+\.?\d*)", expand=False), errors="coerce")
+            typed[col] = values.astype("float32")
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            typed[col] = values
+        else:
+            typed[col] = values.astype("category")
+    return pd.DataFrame(typed).reset_index(drop=True)
+
+
+# Serialized table for download/export; Parquet and Feather use the typed
+# schema and need pyarrow
+def export_table(df, fmt):
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    typed = apply_output_schema(df)
+    if fmt == "parquet":
+        typed.to_parquet(buffer, index=False)
+    elif fmt == "feather":
+        typed.to_feather(buffer)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return buffer.getvalue()
+
+
+CHEMICAL_COLUMN_PATTERN = re.compile(r"(.+) \((%|ppm)\)$")
+PPM_PER_PERCENT = 10000
+
+
+# "CapB (ppm)" -> ("CapB", "ppm"), leftovers of a bracketed note in the
+# name dropped ("Citric acid (S (%)" -> "Citric acid"); None for columns
+# that are not chemicals
+def chemical_column(column):
+    unit_match = CHEMICAL_COLUMN_PATTERN.match(str(column))
+    if not unit_match:
+        return None
+    return re.sub(r"\s*\(.*$", "", unit_match.group(1)), unit_match.group(2)
+
+
+def normalize_term(value):
+    return " ".join(str(value).split()).lower()
+
+
+def edit_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(term, max_distance):
+    variants = {term}
+    for n in range(1, min(max_distance, len(term)) + 1):
+        for drop in combinations(range(len(term)), n):
+            variants.add("".join(char for i, char in enumerate(term) if i not in drop))
+    return variants
+
+
+# Normalized term -> row positions with exact, prefix (bisect over the sorted
+# terms) and edit-distance lookups. Fuzzy matching uses a symmetric deletion
+# index that is built on the first fuzzy query.
+class TermIndex:
+    def __init__(self, postings, max_distance=2):
+        self.postings = postings
+        self.terms = sorted(postings)
+        self.max_distance = max_distance
+        self._deletes = None
+
+    def exact(self, query):
+        query = normalize_term(query)
+        return [query] if query in self.postings else []
+
+    def prefix(self, query):
+        query = normalize_term(query)
+        matches = []
+        for term in self.terms[bisect_left(self.terms, query):]:
+            if not term.startswith(query):
+                break
+            matches.append(term)
+        return matches
+
+    def fuzzy(self, query, max_distance=None):
+        query = normalize_term(query)
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        if self._deletes is None:
+            self._deletes = {}
+            for term in self.terms:
+                for variant in _deletions(term, self.max_distance):
+                    self._deletes.setdefault(variant, []).append(term)
+        candidates = {term for variant in _deletions(query, max_distance) for term in self._deletes.get(variant, [])}
+        scored = [(edit_distance(query, term, max_distance), term) for term in candidates]
+        return [term for distance, term in sorted(scored) if distance <= max_distance]
+
+    def lookup(self, query, mode="exact"):
+        return getattr(self, mode)(query)
+
+    # Row positions of the matched terms, in match order
+    def positions(self, terms):
+        if not terms:
+            return np.array([], dtype=np.intp)
+        return pd.unique(np.concatenate([self.postings[term] for term in terms]))
+
+
+def _postings(values):
+    codes, uniques = pd.factorize(pd.Series(values).map(normalize_term, na_action="ignore"))
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {term: order[bounds[i]:bounds[i + 1]] for i, term in enumerate(uniques)}
+
+
+# Lookup structures built once per parsed dataset: SampleIDs and the chemical
+# names of the "<chem> (%)" / "<chem> (ppm)" formulation columns, both mapped
+# to row positions in final_df.
+class SampleIndex:
+    def __init__(self, final_df, max_distance=2):
+        self.sample_ids = TermIndex(_postings(final_df["SampleID"].to_numpy()), max_distance)
+        chemical_rows = {}
+        for col in final_df.columns:
+            chemical = chemical_column(col)
+            if chemical:
+                rows = np.flatnonzero(final_df[col].notna().to_numpy())
+                chemical_rows.setdefault(normalize_term(chemical[0]), []).append(rows)
+        self.chemicals = TermIndex({chem: np.unique(np.concatenate(rows)) for chem, rows in chemical_rows.items()}, max_distance)
+
+    def search(self, query, mode="exact"):
+        return self.sample_ids.positions(self.sample_ids.lookup(query, mode))
+
+    def search_chemical(self, query, mode="exact"):
+        return self.chemicals.positions(self.chemicals.lookup(query, mode))
+
+
+# One row per SampleID with the amount of every chemical in % (ppm divided
+# by PPM_PER_PERCENT, spellings differing only in case, spacing or a
+# bracketed note merged, absent chemicals 0), for nearest-neighbour queries
+# over formulations. A sample counts as stable at 8C/4C when any of its
+# dilutions is.
+class CompositionMatrix:
+    FLAG_COLUMNS = ["Stable at 8C", "Stable at 4C"]
+
+    def __init__(self, final_df):
+        chemical_cols = [col for col in final_df.columns if chemical_column(col)]
+        flag_cols = [col for col in self.FLAG_COLUMNS if col in final_df.columns]
+        grouped = final_df[final_df["SampleID"].notna().to_numpy()].groupby("SampleID", sort=True)
+        amounts = grouped[chemical_cols].first()
+        self.sample_ids = pd.Index(amounts.index)
+
+        names = {}
+        for col in chemical_cols:
+            name = " ".join(chemical_column(col)[0].split())
+            names.setdefault(normalize_term(name), name)
+        self.chemicals = sorted(names, key=str.lower)
+        self.names = [names[chem] for chem in self.chemicals]
+        positions = {chem: i for i, chem in enumerate(self.chemicals)}
+        self.matrix = np.zeros((len(amounts), len(self.chemicals)))
+        for col in chemical_cols:
+            chem, unit = chemical_column(col)
+            values = pd.to_numeric(amounts[col], errors="coerce").fillna(0).to_numpy(dtype=float)
+            self.matrix[:, positions[normalize_term(chem)]] += values / PPM_PER_PERCENT if unit == "ppm" else values
+        self._norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+
+        self.flags = {}
+        for col in flag_cols:
+            stable = final_df[col].map({True: 1.0, False: 0.0}).astype(float)
+            self.flags[col] = stable.groupby(final_df["SampleID"]).max().reindex(self.sample_ids).to_numpy()
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    # The matrix as a table, one "<chem> (%)" column per chemical
+    def frame(self, sample_ids=None):
+        positions = np.arange(len(self)) if sample_ids is None else self._positions(sample_ids)
+        table = pd.DataFrame(self.matrix[positions], columns=[f"{name} (%)" for name in self.names])
+        table.insert(0, "SampleID", self.sample_ids[positions])
+        return table
+
+    def _positions(self, sample_ids):
+        positions = self.sample_ids.get_indexer(sample_ids)
+        if (positions < 0).any():
+            raise ValueError(f"Unknown SampleID: {', '.join(map(str, np.asarray(sample_ids)[positions < 0]))}")
+        return positions
+
+    # The `k` samples closest to `sample_id` by Euclidean distance between
+    # compositions, nearest first; `stable` maps flag columns to the value
+    # neighbours must have ({"Stable at 4C": True}). Only chemicals present in
+    # the sample or a neighbour are listed.
+    def nearest(self, sample_id, k=20, stable=None):
+        position = self._positions([sample_id])[0]
+        squared = self._norms - 2 * (self.matrix @ self.matrix[position]) + self._norms[position]
+        distances = np.sqrt(np.maximum(squared, 0))
+        candidates = np.arange(len(self)) != position
+        for col, wanted in (stable or {}).items():
+            if col not in self.flags:
+                raise ValueError(f"Unknown stability flag: {col}")
+            candidates &= self.flags[col] == float(wanted)
+        candidates = np.flatnonzero(candidates)
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(distances[candidates], k)[:k]]
+        candidates = candidates[np.lexsort((candidates, distances[candidates]))]
+
+        used = (self.matrix[candidates] != 0).any(axis=0) | (self.matrix[position] != 0)
+        table = pd.DataFrame(self.matrix[np.ix_(candidates, used)], columns=[f"{name} (%)" for name, keep in zip(self.names, used) if keep])
+        table.insert(0, "SampleID", self.sample_ids[candidates])
+        table.insert(1, "Distance", distances[candidates])
+        for i, col in enumerate(self.flags, 2):
+            table.insert(i, col, pd.Series(self.flags[col][candidates]).map({1.0: True, 0.0: False}))
+        return table
+
+
+# Results keyed on a hash of the uploaded bytes plus PARSER_VERSION: a bounded
+# in-memory LRU, optionally backed by pickles in `directory` that survive
+# restarts (oldest-used files are evicted beyond `max_disk_entries`).
+class ParseCache:
+    def __init__(self, max_entries=8, directory=None, max_disk_entries=64):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # digest is SampleStore.digest(data) when the caller already has it
+    @staticmethod
+    def key(data, kind="parse", digest=None):
+        return f"{digest or hashlib.sha256(data).hexdigest()}-{kind}-v{PARSER_VERSION}-{HEADER_MAPPER.fingerprint}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        path = self._disk_path(key)
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as handle:
+                    value = pickle.load(handle)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return None
+            os.utime(path)
+            self._remember(key, value)
+            return value
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        path = self._disk_path(key)
+        if path:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as handle:
+                pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+    # refresh=True re-parses and replaces any cached value
+    def get_or_parse(self, data, parse, kind="parse", refresh=False, digest=None):
+        key = self.key(data, kind, digest)
+        value = None if refresh else self.get(key)
+        if value is None:
+            value = parse(data)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl") if self.directory else None
+
+    def _evict_disk(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pkl")]
+        if len(paths) <= self.max_disk_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Comparison choices of SampleStore.query
+QUERY_OPERATORS = ["=", "!=", ">", ">=", "<", "<=", "contains", "is empty", "is not empty"]
+
+
+def _sql_name(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# SQLite type of a long-table column from its name, so the first file
+# ingested does not decide it: flags and Day_Num are INTEGER, measurements
+# (including labels added through FOAM_HEADER_SYNONYMS) and chemical
+# amounts REAL, everything else TEXT
+def _sql_type(column):
+    name = str(column)
+    if name in BOOLEAN_COLUMNS or name == "Day_Num":
+        return "INTEGER"
+    if name in MEASUREMENT_COLUMNS or name.endswith((" (%)", " (ppm)")) or (name in HEADER_MAPPER.synonyms and name not in TEXT_LABELS):
+        return "REAL"
+    return "TEXT"
+
+
+# Column values converted to `sql_type` for insertion, None where missing;
+# numbers are taken from text like "5cc" as in apply_output_schema
+def _sql_values(values, sql_type, column):
+    if sql_type == "INTEGER" and str(column) in BOOLEAN_COLUMNS:
+        values = values.map({True: 1, False: 0, "True": 1, "False": 0})
+    elif sql_type in ("INTEGER", "REAL") and not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values.astype(str).str.extract(r"([-+]?\d+\.?\d*)", expand=False), errors="coerce")
+    elif sql_type == "TEXT":
+        values = values.where(values.isna(), values.astype(str))
+    if sql_type == "INTEGER":
+        return [None if pd.isna(value) else int(value) for value in values.tolist()]
+    if sql_type == "REAL":
+        return [None if pd.isna(value) else float(value) for value in values.tolist()]
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+# Long tables of every ingested upload in SQLite, one row per sample row
+# with the file it came from. Columns are added as new chemicals appear;
+# SampleID, Dilution, Day (also stored as the number Day_Num, so days can be
+# compared) and every "<chem> (%)"/"<chem> (ppm)" column are indexed. An
+# upload is identified by a hash of its bytes and is only ingested once.
+class SampleStore:
+    INDEXED_COLUMNS = ["SampleID", "Dilution", "Day", "Day_Num"]
+
+    def __init__(self, path=":memory:"):
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ingests (ingest_id INTEGER PRIMARY KEY, source TEXT, digest TEXT UNIQUE, rows INTEGER, ingested_at REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS samples (ingest_id INTEGER REFERENCES ingests (ingest_id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS samples_ingest ON samples (ingest_id)")
+        self._columns = {name: sql_type for _, name, sql_type, *_ in self._conn.execute("PRAGMA table_info(samples)") if name != "ingest_id"}
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    # Stores `final_df` as coming from `source`; False (and nothing stored)
+    # when an upload with this digest was ingested before
+    def add(self, final_df, source, digest):
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM ingests WHERE digest = ?", (digest,)).fetchone():
+                return False
+            if "Day" in final_df.columns:
+                day_num = pd.to_numeric(final_df["Day"].astype(str).str.extract(r"(\d+)", expand=False), errors="coerce")
+                final_df = final_df.assign(Day_Num=day_num.astype("Int64"))
+            for column in final_df.columns:
+                if column not in self._columns:
+                    self._add_column(column, _sql_type(column))
+            ingest_id = self._conn.execute(
+                "INSERT INTO ingests (source, digest, rows, ingested_at) VALUES (?, ?, ?, ?)",
+                (source, digest, len(final_df), time.time()),
+            ).lastrowid
+            columns = [_sql_values(final_df[column], self._columns[column], column) for column in final_df.columns]
+            names = ", ".join(["ingest_id"] + [_sql_name(column) for column in final_df.columns])
+            marks = ", ".join("?" * (len(final_df.columns) + 1))
+            self._conn.executemany(f"INSERT INTO samples ({names}) VALUES ({marks})", ((ingest_id, *row) for row in zip(*columns)))
+            self._conn.commit()
+        return True
+
+    def _add_column(self, column, sql_type):
+        self._conn.execute(f"ALTER TABLE samples ADD COLUMN {_sql_name(column)} {sql_type}")
+        self._columns[column] = sql_type
+        if column in self.INDEXED_COLUMNS or str(column).endswith((" (%)", " (ppm)")):
+            index_name = "samples_" + hashlib.sha1(str(column).encode()).hexdigest()[:12]
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON samples ({_sql_name(column)})")
+
+    def columns(self):
+        return dict(self._columns)
+
+    def chemical_columns(self):
+        return [column for column in self._columns if column.endswith((" (%)", " (ppm)"))]
+
+    def sources(self):
+        with self._lock:
+            return pd.read_sql_query("SELECT source AS 'Source File', rows AS Rows, datetime(ingested_at, 'unixepoch') AS Ingested FROM ingests ORDER BY ingest_id", self._conn)
+
+    # Rows matching every (column, operator, value) filter, operators from
+    # QUERY_OPERATORS; values are compared as numbers in numeric columns and
+    # as true/false in flag columns
+    def query(self, filters=(), limit=100000):
+        clauses = []
+        params = []
+        for column, operator, value in filters:
+            if column not in self._columns:
+                raise ValueError(f"Unknown column: {column}")
+            if operator not in QUERY_OPERATORS:
+                raise ValueError(f"Unknown operator: {operator}")
+            name = _sql_name(column)
+            if operator == "is empty":
+                clauses.append(f"{name} IS NULL")
+            elif operator == "is not empty":
+                clauses.append(f"{name} IS NOT NULL")
+            elif operator == "contains":
+                clauses.append(f"{name} LIKE ?")
+                params.append(f"%{value}%")
+            else:
+                clauses.append(f"{name} {operator} ?")
+                params.append(self._query_value(column, value))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        names = ", ".join(f"samples.{_sql_name(column)}" for column in self._columns)
+        sql = f"SELECT ingests.source AS 'Source File', {names} FROM samples JOIN ingests USING (ingest_id) {where} ORDER BY samples.rowid LIMIT ?"
+        with self._lock:
+            rows = pd.read_sql_query(sql, self._conn, params=params + [limit])
+        # Flags come back from SQLite as 0/1
+        for column in self._columns:
+            if column in BOOLEAN_COLUMNS:
+                rows[column] = rows[column].map({1: True, 0: False})
+        return rows
+
+    def _query_value(self, column, value):
+        if column in BOOLEAN_COLUMNS:
+            return 1 if str(value).strip().lower() in ("1", "true", "yes", "y") else 0
+        if self._columns[column] in ("REAL", "INTEGER"):
+            try:
+                return float(value)
+            except ValueError:
+                raise ValueError(f"{column} holds numbers, not: {value}")
+        return str(value)
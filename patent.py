@@ -1,8 +1,8 @@
 import streamlit as st
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+import patentUtility
 import io
+import os
 
 st.set_page_config(page_title="Smart Patent Search (only Claims)", layout="wide")
 st.title("🔍 Smart Patent Search")
@@ -31,25 +31,48 @@ if upload_option == "📁 Upload CSV":
 if upload_option == "🔗 Enter URLs manually":
     url_input = st.text_area("Enter Google Patent URLs (one per line):", height=200)
 
-@st.cache_data(show_spinner=False)
-def extract_title_and_claims_from_google_patent_url(url):
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.content, "html.parser")
+with st.sidebar:
+    st.markdown("### Fetch settings")
+    workers = st.slider("Concurrent requests", 1, 32, 8)
+    per_host_rate = st.number_input("Requests per second per host", 0.5, 50.0, 4.0, step=0.5)
+    retries = st.number_input("Retries on transient errors", 0, 10, 3)
+
+
+# Set PATENT_CACHE_PATH (default patent_cache.sqlite), PATENT_CACHE_TTL_DAYS
+# and PATENT_CACHE_MAX_MB to control the on-disk page cache
+@st.cache_resource
+def get_patent_cache():
+    return patentUtility.PatentCache(
+        os.environ.get("PATENT_CACHE_PATH", "patent_cache.sqlite"),
+        ttl=float(os.environ.get("PATENT_CACHE_TTL_DAYS", 30)) * 24 * 3600,
+        max_bytes=int(float(os.environ.get("PATENT_CACHE_MAX_MB", 200)) * 1e6),
+    )
+
+
+# Every fetched title and claim, searchable across sessions
+@st.cache_resource
+def get_claim_index():
+    return patentUtility.ClaimIndex(os.environ.get("PATENT_INDEX_PATH", "patent_index.sqlite"))
+
 
-        # Extract Title
-        title_tag = soup.find("span", {"itemprop": "title"})
-        title = title_tag.text.strip() if title_tag else "No title found"
+@st.cache_resource
+def get_session(pool_size):
+    return patentUtility.make_session(pool_size)
 
-        # Extract Claims
-        claims = soup.find_all("div", {"class": "claim"})
-        claim_texts = [c.text.strip() for c in claims]
 
-        return title, claim_texts
+def extract_titles_and_claims(urls):
+    progress_bar = st.progress(0.0, text=f"Fetching {len(urls)} patents...")
 
-    except Exception as e:
-        return "Error", [f"Error retrieving data from {url}: {str(e)}"]
+    def report(done, total, url):
+        progress_bar.progress(done / total, text=f"Fetched {done}/{total}: {url}")
+
+    results = patentUtility.fetch_patents(
+        urls, workers=workers, per_host_rate=per_host_rate, retries=retries,
+        session=get_session(workers), progress=report, cache=get_patent_cache(),
+    )
+    progress_bar.empty()
+    get_claim_index().add_many(results)
+    return results
 
 # Display extracted URLs if from CSV
 if upload_option == "📁 Upload CSV" and url_input:
@@ -62,23 +85,32 @@ if st.button("Extract Claims"):
         st.warning("Please enter at least one patent URL.")
     else:
         with st.spinner("Extracting patent titles and claims..."):
-            all_data = []
-            full_text = ""
-
-            for idx, url in enumerate(urls):
-                title, claims = extract_title_and_claims_from_google_patent_url(url)
-                all_data.append((url, title, claims))
-
-                full_text += f"Patent {idx+1}: {url}\n"
-                full_text += f"Title: {title}\n"
-                for i, c in enumerate(claims[:100]):
-                    full_text += f"  Claim {i+1}: {c}\n"
-                full_text += "\n"
+            all_data = extract_titles_and_claims(urls)
+            full_text = patentUtility.claims_text(all_data)
 
             for url, title, claims in all_data:
                 st.markdown(f"### 🔗 [{url}]({url})")
                 st.markdown(f"**Title: {title}**")
-                for i, c in enumerate(claims[:100]):
-                    st.write(f"**Claim {i+1}:** {c}")
+                for c in claims[:100]:
+                    depends_on = f" _(depends on claim {', '.join(map(str, c['depends_on']))})_" if c["depends_on"] else ""
+                    st.write(f"**Claim {c['number']}:**{depends_on} {c['text']}")
 
             st.download_button("📄 Download Claims.txt", full_text.encode("utf-8"), file_name="patent_claims.txt")
+
+# Claim search over everything fetched so far
+st.markdown("### 🔎 Search Claims")
+n_patents, n_claims = get_claim_index().counts()
+query = st.text_input("Search titles and claims (e.g. CapB AND citric, \"citric acid\", foam stabil*):")
+st.caption(f"{n_claims} claims from {n_patents} patents indexed.")
+if query:
+    try:
+        matches = get_claim_index().search(query)
+        if not matches:
+            st.warning(f"No claims match: {query}")
+    except ValueError as e:
+        st.error(f"⚠️ Error: {str(e)}")
+        matches = []
+    for patent in matches:
+        st.markdown(f"#### 🔗 [{patent['title']}]({patent['url']}) — {len(patent['hits'])} matches")
+        for number, snippet in patent["hits"]:
+            st.write(f"**{f'Claim {number}' if number else 'Title'}:** {snippet}")
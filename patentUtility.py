@@ -0,0 +1,334 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+USER_AGENT = "Mozilla/5.0"
+# Worth another try: rate limiting and server-side hiccups
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Only the title and the claims section are built from a patent page
+PAGE_STRAINER = SoupStrainer(attrs={"itemprop": ["title", "claims"]})
+CLAIM_NUMBER_PATTERN = re.compile(r"^\s*(\d+)\s*\.")
+CLAIM_REFERENCE_PATTERN = re.compile(r"\bclaims?\s+(\d+)", re.IGNORECASE)
+
+
+def make_session(pool_size=8):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+# At most `per_second` requests start per host; callers reserve the next free
+# slot under the lock and sleep outside it
+class HostRateLimiter:
+    def __init__(self, per_second=4.0):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Seconds to wait before retrying: the server's numeric Retry-After or
+# exponential backoff, never more than `max_backoff`
+def _retry_delay(response, attempt, backoff, max_backoff=30):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), max_backoff)
+    return min(backoff * 2 ** attempt, max_backoff)
+
+
+# HTML of one page; connection errors, timeouts and RETRY_STATUS responses
+# are retried `retries` times with exponential backoff (at most `max_backoff`
+# seconds per wait), anything else raises
+def fetch_page(session, url, limiter=None, retries=3, backoff=0.5, timeout=10, max_backoff=30):
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait(url)
+        response = None
+        try:
+            response = session.get(url, timeout=timeout)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.content
+            error = requests.HTTPError(f"{response.status_code} Server Error for url: {url}", response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt == retries:
+            raise error
+        time.sleep(_retry_delay(response, attempt, backoff, max_backoff))
+
+
+# Claim number from the num attribute or the leading "3." of the text, and
+# the claims it depends on from <claim-ref> links or "claim 1" in the text
+def parse_claim(tag, position):
+    text = tag.text.strip()
+    number = tag.get("num", "")
+    if not number.isdigit():
+        match = CLAIM_NUMBER_PATTERN.match(text)
+        number = match.group(1) if match else position
+    refs = [ref.get("idref", "") for ref in tag.find_all("claim-ref")]
+    depends_on = [int(re.sub(r"\D", "", ref)) for ref in refs if re.search(r"\d", ref)]
+    if not refs:
+        depends_on = [int(ref) for ref in CLAIM_REFERENCE_PATTERN.findall(text)]
+    return {"number": int(number), "text": text, "depends_on": list(dict.fromkeys(depends_on))}
+
+
+# Byte ranges of the first title span and of the claims section, cut out
+# before parsing so the (much larger) description is never tokenized
+def _page_fragments(html):
+    fragments = []
+    for marker, end_tag in [(b'itemprop="title"', b"</span>"), (b'itemprop="claims"', b"</section>")]:
+        position = html.find(marker)
+        if position < 0:
+            continue
+        start = html.rfind(b"<", 0, position)
+        end = html.find(end_tag, position)
+        if start >= 0 and end >= 0:
+            fragments.append(html[start:end + len(end_tag)])
+    return b"".join(fragments)
+
+
+# Title and claims ({"number", "text", "depends_on"}) of a Google Patents
+# page. Only the title span and the claims section are cut out and parsed
+# (with lxml when it is installed); pages where that finds no claims fall back
+# to a full html.parser parse.
+def parse_patent_page(html):
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    fragments = _page_fragments(html)
+    claims = []
+    if fragments:
+        soup = BeautifulSoup(fragments, HTML_PARSER, parse_only=PAGE_STRAINER, from_encoding="utf-8")
+        claims = soup.find_all("div", {"class": "claim"})
+    if not claims:
+        soup = BeautifulSoup(html, "html.parser")
+        claims = soup.find_all("div", {"class": "claim"})
+
+    # Extract Title
+    title_tag = soup.find("span", {"itemprop": "title"})
+    title = title_tag.text.strip() if title_tag else "No title found"
+
+    return title, [parse_claim(claim, position) for position, claim in enumerate(claims, 1)]
+
+
+def fetch_patent(session, url, limiter=None, retries=3, backoff=0.5, timeout=10, max_backoff=30):
+    try:
+        return parse_patent_page(fetch_page(session, url, limiter, retries, backoff, timeout, max_backoff))
+    except Exception as e:
+        return "Error", [{"number": 1, "text": f"Error retrieving data from {url}: {str(e)}", "depends_on": []}]
+
+
+# Scheme and host lower-cased, query, fragment and trailing slash dropped, so
+# links copied from search results (?oq=...) share one cache entry
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower() or "https", parts.netloc.lower(), parts.path.rstrip("/"), "", ""))
+
+
+# Bump whenever the stored claim layout changes so old entries are dropped
+PATENT_CACHE_LAYOUT = 2
+
+
+# Extracted titles and claims by normalized URL in SQLite. Entries older than
+# `ttl` seconds are refetched; least recently used entries are dropped once
+# the stored claims exceed `max_bytes`. Only successful fetches are stored.
+class PatentCache:
+    def __init__(self, path=":memory:", ttl=30 * 24 * 3600, max_bytes=200_000_000):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != PATENT_CACHE_LAYOUT:
+            self._conn.execute("DROP TABLE IF EXISTS patents")
+            self._conn.execute(f"PRAGMA user_version = {PATENT_CACHE_LAYOUT}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS patents (url TEXT PRIMARY KEY, title TEXT, claims TEXT, size INTEGER, fetched_at REAL, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS patents_last_used ON patents (last_used)")
+
+    def get_many(self, urls):
+        keys = {normalize_url(url): url for url in urls}
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique = list(keys)
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT url, title, claims FROM patents WHERE url IN ({marks}) AND fetched_at > ?", chunk + [now - self.ttl])
+                found.update((key, (title, json.loads(claims))) for key, title, claims in rows)
+                self._conn.execute(f"UPDATE patents SET last_used = ? WHERE url IN ({marks})", [now] + chunk)
+            self._conn.commit()
+        return {url: found[normalize_url(url)] for url in urls if normalize_url(url) in found}
+
+    def put_many(self, results):
+        rows = []
+        now = time.time()
+        for url, (title, claims) in results.items():
+            if title == "Error":
+                continue
+            claims_json = json.dumps(claims)
+            rows.append((normalize_url(url), title, claims_json, len(title) + len(claims_json), now, now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO patents VALUES (?, ?, ?, ?, ?, ?)", rows)
+            # Drop the least recently used entries beyond max_bytes in total
+            self._conn.execute(
+                "DELETE FROM patents WHERE url IN (SELECT url FROM (SELECT url, SUM(size) OVER (ORDER BY last_used DESC, url) AS total FROM patents) WHERE total > ?)",
+                (self.max_bytes,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM patents")
+            self._conn.commit()
+
+
+# Claims.txt download: up to `max_claims` claims per patent
+def claims_text(results, max_claims=100):
+    lines = []
+    for idx, (url, title, claims) in enumerate(results):
+        lines.append(f"Patent {idx+1}: {url}")
+        lines.append(f"Title: {title}")
+        lines.extend(f"  Claim {c['number']}: {c['text']}" for c in claims[:max_claims])
+        lines.append("")
+    return "".join(line + "\n" for line in lines)
+
+
+QUERY_TOKEN_PATTERN = re.compile(r'"([^"]*)"|\b(AND|OR|NOT)\b|([^\W_]+)(\*)?', re.UNICODE)
+
+
+# User query -> FTS5 query: "quoted phrases", AND/OR/NOT and trailing-*
+# prefixes are kept, every other word is quoted so stray punctuation cannot
+# break the syntax; neighbouring terms are ANDed. NOT excludes from the
+# terms before it, so a NOT with nothing (or OR/NOT) before it raises
+# ValueError rather than being dropped; "AND NOT" reads as NOT.
+def fts_query(query):
+    parts = []
+    for phrase, operator, word, star in QUERY_TOKEN_PATTERN.findall(query):
+        if operator == "NOT":
+            if not parts or parts[-1] in ("OR", "NOT"):
+                raise ValueError(f"NOT needs terms to exclude from before it, e.g. 'foam NOT silicone': {query}")
+            if parts[-1] == "AND":
+                parts[-1] = "NOT"
+            else:
+                parts.append(operator)
+        elif operator:
+            if parts and parts[-1] not in ("AND", "OR", "NOT"):
+                parts.append(operator)
+        elif phrase.strip():
+            parts.append('"' + phrase.replace('"', "") + '"')
+        elif word:
+            parts.append(f'"{word}"' + star)
+    while parts and parts[-1] in ("AND", "OR", "NOT"):
+        parts.pop()
+    return " ".join(parts)
+
+
+# Full-text index of every fetched title and claim in SQLite FTS5, one row
+# per claim plus one (number 0) for the title. Re-adding a patent replaces
+# its rows.
+class ClaimIndex:
+    def __init__(self, path=":memory:"):
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS claims USING fts5(url UNINDEXED, title UNINDEXED, number UNINDEXED, text, tokenize='unicode61', prefix='2 3 4')"
+        )
+
+    def add_many(self, results):
+        rows = []
+        urls = []
+        for url, title, claims in results:
+            if title == "Error":
+                continue
+            urls.append(normalize_url(url))
+            rows.append((urls[-1], title, 0, title))
+            rows.extend((urls[-1], title, claim["number"], claim["text"]) for claim in claims)
+        if not urls:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM claims WHERE url = ?", [(url,) for url in urls])
+            self._conn.executemany("INSERT INTO claims (url, title, number, text) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def counts(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT url), COUNT(*) FROM claims").fetchone()
+
+    # Patents with claims matching `query`, best match first, as dicts with
+    # "url", "title", "score" and "hits" [(claim number, snippet)], where
+    # number 0 is a match in the title; matches
+    # in snippets are wrapped in `mark`. Raises ValueError for a query
+    # fts_query rejects
+    def search(self, query, limit=200, mark="**"):
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, title, number, snippet(claims, 3, ?, ?, '…', 16), bm25(claims) FROM claims WHERE claims MATCH ? ORDER BY rank LIMIT ?",
+                (mark, mark, match, limit),
+            ).fetchall()
+        patents = {}
+        for url, title, number, snippet, score in rows:
+            patent = patents.setdefault(url, {"url": url, "title": title, "score": score, "hits": []})
+            patent["hits"].append((number, snippet))
+        for patent in patents.values():
+            patent["hits"].sort()
+        return list(patents.values())
+
+
+# (url, title, claims) for every URL in input order, fetched by `workers`
+# threads over one pooled session. Failed URLs get the title "Error" and the
+# error message as the text of their only claim. With a PatentCache, fresh cached pages
+# are not fetched and successful fetches are stored as they finish.
+# `progress(done, total, url)` is called from the calling thread as each
+# fetched URL finishes.
+def fetch_patents(urls, workers=8, per_host_rate=4.0, retries=3, backoff=0.5, timeout=10, session=None, progress=None, cache=None, max_backoff=30):
+    results = cache.get_many(urls) if cache is not None else {}
+    missing = [url for url in dict.fromkeys(urls) if url not in results]
+    if missing:
+        session = session or make_session(workers)
+        limiter = HostRateLimiter(per_host_rate)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_patent, session, url, limiter, retries, backoff, timeout, max_backoff): url for url in missing}
+            for done, future in enumerate(as_completed(futures), 1):
+                url = futures[future]
+                results[url] = future.result()
+                if cache is not None:
+                    cache.put_many({url: results[url]})
+                if progress is not None:
+                    progress(done, len(missing), url)
+    return [(url, *results[url]) for url in urls]
@@ -0,0 +1,91 @@
+# Local stand-in for Google Patents serving canned claim pages, for trying the
+# patent fetcher offline: python patent_stub_server.py --port 8765
+# Pages live at /patent/<ID>/en; /flaky/<ID>/en fails with 503 every other
+# request and /slow/<ID>/en answers after --delay seconds.
+import argparse
+import html
+import itertools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CLAIM_BODIES = [
+    "A foam composition comprising CapB and citric acid.",
+    "The composition of claim {first} wherein the foam is stable at 4C.",
+    "The composition of claim {first} wherein the CapB concentration is 500 ppm.",
+    "A method of stabilizing a foam comprising adding a foam stabilizer to the composition of claim {previous}.",
+]
+
+
+# Laid out like a Google Patents page: dependent claims are wrapped in
+# div.claim-dependent and point at their parent with <claim-ref>, and the
+# description is padded to `description_paragraphs` paragraphs
+def patent_page(patent_id, n_claims=4, description_paragraphs=2000):
+    claims = []
+    for number in range(1, n_claims + 1):
+        body = CLAIM_BODIES[(number - 1) % len(CLAIM_BODIES)]
+        parent = 1 if "{first}" in body else max(number - 1, 1)
+        ref = f'<claim-ref idref="CLM-{parent:05d}">claim {parent}</claim-ref>'
+        text = html.escape(body).replace("claim {first}", ref).replace("claim {previous}", ref)
+        claim = f'<div id="CLM-{number:05d}" class="claim" num="{number:05d}"><div class="claim-text">{number}. {text}</div></div>'
+        claims.append(f'<div class="claim-dependent">{claim}</div>' if ref in text else claim)
+    description = "".join(
+        f'<div class="description-paragraph" num="{i:04d}">Example {i}: the foam of formulation F{i} was monitored for 28 days at 4C and 8C.</div>'
+        for i in range(description_paragraphs)
+    )
+    return (
+        f"<html><head><title>{patent_id}</title></head><body>"
+        f'<span itemprop="title">Foam stabilizer {html.escape(patent_id)}</span>'
+        f'<section itemprop="description"><div class="description">{description}</div></section>'
+        f'<section itemprop="claims"><div class="claims">{"".join(claims)}</div></section>'
+        "</body></html>"
+    ).encode("utf-8")
+
+
+def make_handler(delay=0.5):
+    counter = itertools.count()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) < 2 or parts[0] not in ("patent", "flaky", "slow"):
+                self.send_error(404)
+                return
+            if parts[0] == "flaky" and next(counter) % 2 == 0:
+                self.send_error(503)
+                return
+            if parts[0] == "slow":
+                time.sleep(delay)
+            body = patent_page(parts[1])
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Server running on a background thread; port=0 picks a free port
+# (server.server_address[1]); call server.shutdown() when done
+def serve(port=0, delay=0.5):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve canned patent pages on localhost.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="response delay of /slow/ pages in seconds")
+    args = parser.parse_args(argv)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.delay))
+    print(f"Serving canned patent pages on http://127.0.0.1:{args.port}/patent/<ID>/en")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import csv
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import foam_synth
+
+
+# synthetic_sheet(n_rows, seed=0) -> CSV bytes of a foam_synth sheet, as uploaded
+@pytest.fixture
+def synthetic_sheet():
+    def make(n_rows, seed=0):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(foam_synth.generate_rows(n_rows, seed))
+        return buffer.getvalue().encode("utf-8")
+    return make
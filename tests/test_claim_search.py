@@ -0,0 +1,31 @@
+import pytest
+
+import patentUtility
+
+RESULTS = [
+    ("https://patents.example/US1", "Silicone foam", [{"number": 1, "text": "A foam with silicone oil"}]),
+    ("https://patents.example/US2", "Foam B", [{"number": 1, "text": "A foam with citric acid"}]),
+    ("https://patents.example/US3", "Gel C", [{"number": 1, "text": "A gel with citric acid"}]),
+]
+
+
+def search_titles(query):
+    index = patentUtility.ClaimIndex()
+    index.add_many(RESULTS)
+    return sorted(patent["title"] for patent in index.search(query))
+
+
+def test_not_excludes_from_the_terms_before_it():
+    assert patentUtility.fts_query("foam NOT silicone") == '"foam" NOT "silicone"'
+    assert patentUtility.fts_query("foam AND NOT silicone") == '"foam" NOT "silicone"'
+    assert search_titles("foam AND NOT silicone") == ["Foam B"]
+
+
+# A NOT with nothing to exclude from used to be dropped, returning exactly
+# the claims the user asked to exclude
+@pytest.mark.parametrize("query", ["NOT silicone", "citric OR NOT silicone", "foam NOT NOT silicone"])
+def test_dangling_not_is_rejected(query):
+    with pytest.raises(ValueError, match="NOT"):
+        patentUtility.fts_query(query)
+    with pytest.raises(ValueError):
+        search_titles(query)
@@ -0,0 +1,20 @@
+import myUtility
+
+# A header on the dilution row shares it with the dilution labels
+DILUTION_HEADER_SHEET = b"""1% CapB (P1),,,,
+10X,15 mL tube,DI water,Foam (cc),Texture
+Day 0,,,30,fine
+"""
+
+
+# "DI water" is a dilution label, not the Water (cc) column
+def test_dilution_label_is_not_a_water_column():
+    column_map = myUtility.map_header_columns(["10X", "15 mL tube", "DI water", "Foam (cc)", "Texture"])
+    assert column_map == {"Foam (cc)": 3, "Foam Texture": 4}
+    assert myUtility.map_header_columns(["Day", "Date", "Foam (cc)", "Water (cc)"])["Water (cc)"] == 3
+
+
+def test_dilution_header_row_is_parsed():
+    final_df = myUtility.parse_foam_csv(DILUTION_HEADER_SHEET)["final_df"]
+    assert final_df["Foam (cc)"].tolist() == [30]
+    assert final_df["Water (cc)"].isna().all()
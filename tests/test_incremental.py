@@ -0,0 +1,50 @@
+import pandas as pd
+
+import myUtility
+
+# A formulation row mentioning "foam" right after a dilution row is taken
+# as that dilution's header, so the block before it consumes its first row
+CONSUMED_FORMULATION = b"""1% A (C1),,
+5X,,
+Day 0,3,fine
+10X,,
+1% foam B (C2),,
+Day 1,5,ok
+1% D (),,
+Day 2,6,ok
+"""
+
+
+def assert_same_as_full_parse(df, store, stats=None):
+    expected_counts, counts = {}, {}
+    expected = myUtility.assemble_final_df(*myUtility.extract_samples_complete_fixed(df, row_counts=expected_counts))
+    actual = myUtility.assemble_final_df(*myUtility.extract_samples_incremental(df, store, stats, row_counts=counts))
+    pd.testing.assert_frame_equal(expected, actual)
+    assert counts == expected_counts
+
+
+def test_unchanged_sheet_reuses_every_block(synthetic_sheet):
+    df = myUtility.read_raw_sheet(synthetic_sheet(3000))
+    store = myUtility.BlockStore()
+    assert_same_as_full_parse(df, store)
+    stats = {}
+    assert_same_as_full_parse(df, store, stats)
+    assert stats["parsed"] == 0 and stats["reused"] == stats["blocks"]
+
+
+def test_edited_block_is_reparsed(synthetic_sheet):
+    df = myUtility.read_raw_sheet(synthetic_sheet(3000))
+    store = myUtility.BlockStore()
+    assert_same_as_full_parse(df, store)
+    day_row = df.index[df[0].astype(str).str.startswith("Day")][10]
+    df.iat[day_row, 2] = "99"
+    stats = {}
+    assert_same_as_full_parse(df, store, stats)
+    assert stats["parsed"] == 1
+
+
+def test_consumed_formulation_row():
+    df = myUtility.read_raw_sheet(CONSUMED_FORMULATION)
+    store = myUtility.BlockStore()
+    assert_same_as_full_parse(df, store)
+    assert_same_as_full_parse(df, store)
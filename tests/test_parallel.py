@@ -0,0 +1,31 @@
+import re
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+import myUtility
+
+
+# Formulations on every fifth row lose their ID ("()") and get a Sample_N
+# fallback
+def sheet_without_some_ids(data):
+    lines = data.decode("utf-8").splitlines(keepends=True)
+    lines[::5] = [re.sub(r"\(F\d+\)", "()", line) for line in lines[::5]]
+    return myUtility.read_raw_sheet("".join(lines).encode("utf-8"))
+
+
+# Small blocks and classify chunks so every sheet is split across workers
+@pytest.mark.parametrize("n_rows, seed", [(1500, 0), (3000, 7)])
+def test_parallel_matches_sequential(monkeypatch, synthetic_sheet, n_rows, seed):
+    monkeypatch.setattr(myUtility, "CLASSIFY_CHUNK_ROWS", 256)
+    df = sheet_without_some_ids(synthetic_sheet(n_rows, seed))
+    expected_counts, counts = {}, {}
+    expected_headers, headers = Counter(), Counter()
+    samples, formulations = myUtility.extract_samples_complete_fixed(df, expected_counts, expected_headers)
+    assert any(sample_id.startswith("Sample_") for sample_id in formulations)
+    expected = myUtility.assemble_final_df(samples, formulations)
+    actual = myUtility.assemble_final_df(*myUtility.extract_samples_parallel(df, workers=2, block_rows=100, row_counts=counts, unmapped_headers=headers))
+    pd.testing.assert_frame_equal(expected, actual)
+    assert counts == expected_counts
+    assert headers == expected_headers
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+import requests
+
+import patent_stub_server
+import patentUtility
+
+
+# Remembers when each request started
+class RecordingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.started = []
+
+    def get(self, url, **kwargs):
+        self.started.append(time.monotonic())
+        return super().get(url, **kwargs)
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = patent_stub_server.serve(port=0, delay=0.3)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_results_keep_input_order(base_url):
+    urls = [f"{base_url}/slow/US1/en", f"{base_url}/patent/US2/en", f"{base_url}/patent/US3/en"]
+    results = patentUtility.fetch_patents(urls, workers=3, per_host_rate=0)
+    assert [url for url, title, claims in results] == urls
+    assert [title for url, title, claims in results] == ["Foam stabilizer US1", "Foam stabilizer US2", "Foam stabilizer US3"]
+    assert [claim["number"] for claim in results[0][2]] == [1, 2, 3, 4]
+
+
+def test_flaky_pages_succeed_after_a_retry(base_url):
+    urls = [f"{base_url}/flaky/US{i}/en" for i in range(4)]
+    results = patentUtility.fetch_patents(urls, workers=1, per_host_rate=0, retries=1, backoff=0.01)
+    assert all(title != "Error" for url, title, claims in results)
+    results = patentUtility.fetch_patents(urls[:1], workers=1, per_host_rate=0, retries=0)
+    assert results[0][1] == "Error" and "503" in results[0][2][0]["text"]
+
+
+def test_not_found_is_an_error_and_not_cached(base_url):
+    cache = patentUtility.PatentCache()
+    urls = [f"{base_url}/patent/US1/en", f"{base_url}/missing/US2/en"]
+    results = patentUtility.fetch_patents(urls, workers=2, per_host_rate=0, backoff=0.01, cache=cache)
+    assert results[1][1] == "Error" and "404" in results[1][2][0]["text"]
+    assert list(cache.get_many(urls)) == [patentUtility.normalize_url(urls[0])]
+
+
+def test_requests_per_host_are_spaced_out(base_url):
+    session = RecordingSession()
+    urls = [f"{base_url}/patent/US{i}/en" for i in range(5)]
+    patentUtility.fetch_patents(urls, workers=5, per_host_rate=10.0, session=session)
+    gaps = [later - earlier for earlier, later in zip(sorted(session.started), sorted(session.started)[1:])]
+    assert len(gaps) == 4 and min(gaps) >= 0.09
+
+
+def test_retry_after_is_capped():
+    response = requests.Response()
+    response.headers["Retry-After"] = "3600"
+    assert patentUtility._retry_delay(response, 0, 0.5, max_backoff=5) == 5
+    assert patentUtility._retry_delay(None, 10, 0.5, max_backoff=5) == 5
+    assert patentUtility._retry_delay(None, 1, 0.5) == 1.0
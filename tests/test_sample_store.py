@@ -0,0 +1,36 @@
+import myUtility
+
+# No stability notes and no Zeta/Size/PI/Conductivity/Water columns
+SPARSE_SHEET = b"""1% CapB (P1),,,
+10X,15 mL tube,,
+Day,Date,Foam amount (cc),Foam texture
+Day 0,1/1/2024,30,fine
+Day 1,1/2/2024,25,coarse
+"""
+
+
+# Column types come from the schema, not from the first file ingested
+def test_types_do_not_depend_on_first_ingest(synthetic_sheet):
+    store = myUtility.SampleStore()
+    sparse = myUtility.parse_foam_csv(SPARSE_SHEET)["final_df"]
+    assert store.add(sparse, "sparse.csv", myUtility.SampleStore.digest(SPARSE_SHEET))
+    data = synthetic_sheet(3000)
+    final_df = myUtility.parse_foam_csv(data)["final_df"]
+    assert store.add(final_df, "synthetic.csv", myUtility.SampleStore.digest(data))
+    assert not store.add(final_df, "again.csv", myUtility.SampleStore.digest(data))
+
+    columns = store.columns()
+    for column in ["Stable at 4C", "Stable at 8C", "Sonicated", "Day_Num"]:
+        assert columns[column] == "INTEGER"
+    for column in ["Foam (cc)", "Zeta", "Size", "PI", "Conductivity", "Water (cc)", "CapB (%)"]:
+        assert columns[column] == "REAL"
+
+    stable = store.query([("Stable at 4C", "=", "true")])
+    assert len(stable) == (final_df["Stable at 4C"] == True).sum()  # noqa: E712
+    assert stable["Stable at 4C"].map(lambda value: value is True).all()
+
+    size = final_df["Size"].astype(float)
+    assert len(store.query([("Size", ">", "500")])) == (size > 500).sum()
+    zeta = final_df["Zeta"].astype(float)
+    assert len(store.query([("Zeta", "<", "-30")])) == (zeta < -30).sum()
+    assert len(store.query([("Day_Num", ">=", "3")])) == final_df["Day"].str.extract(r"(\d+)", expand=False).astype(float).ge(3).sum()